@@ -2,7 +2,7 @@ import os
 
 from chimerax.atomic import AtomicStructureArg
 from chimerax.core.toolshed import BundleAPI
-from chimerax.core.commands import BoolArg, FileNameArg, FloatArg, StringArg, register
+from chimerax.core.commands import BoolArg, FileNameArg, FloatArg, IntArg, StringArg, register
 
 class _ora_stuff_API(BundleAPI):
 
@@ -41,6 +41,8 @@ class _ora_stuff_API(BundleAPI):
         if command_info.name == "guessBondOrders":
             from .commands.guess_bond_orders import guessBondOrders_description, guessBondOrders
             register("guessBondOrders", guessBondOrders_description, guessBondOrders)
+            from .commands.guess_bond_orders import guessBondOrders_stop_description, guessBondOrders_stop
+            register("guessBondOrders stop", guessBondOrders_stop_description, guessBondOrders_stop)
         if command_info.name == "editCoordinateSets":
             from .commands.edit_coordinate_sets import trim_cs_description, trim_cs
             register("editCoordinateSets trim", trim_cs_description, trim_cs)
@@ -48,6 +50,15 @@ class _ora_stuff_API(BundleAPI):
             register("editCoordinateSets reverse", flip_cs_description, flip_cs)
             from .commands.edit_coordinate_sets import combine_cs_description, combine_cs
             register("editCoordinateSets combine", combine_cs_description, combine_cs)
+            from .commands.edit_coordinate_sets import decimate_cs_description, decimate_cs
+            register("editCoordinateSets decimate", decimate_cs_description, decimate_cs)
+            from .commands.edit_coordinate_sets import align_cs_description, align_cs
+            register("editCoordinateSets align", align_cs_description, align_cs)
+        if command_info.name == "blenderJobs":
+            from .commands.blender_jobs import blenderJobs_description, blenderJobs
+            register("blenderJobs", blenderJobs_description, blenderJobs)
+            from .commands.blender_jobs import blenderJobs_stop_description, blenderJobs_stop
+            register("blenderJobs stop", blenderJobs_stop_description, blenderJobs_stop)
 
     @staticmethod
     def run_provider(session, name, mgr, **kw):
@@ -71,7 +82,15 @@ class _ora_stuff_API(BundleAPI):
                     
                     @property
                     def open_args(self):
-                        return {}
+                        return {
+                            'first': IntArg,
+                            'last': IntArg,
+                            'stride': IntArg,
+                            'lazy': BoolArg,
+                            'frameCache': IntArg,
+                            'processes': IntArg,
+                            'cache': BoolArg,
+                        }
                 
                 return Info()
         
@@ -90,6 +109,8 @@ class _ora_stuff_API(BundleAPI):
                             'model': AtomicStructureArg,
                             'style': StringArg,
                             'coordsets': BoolArg,
+                            'compressionLevel': IntArg,
+                            'processes': IntArg,
                         }
                     
                     def save_args_widget(self, session):
@@ -144,7 +165,15 @@ class _ora_stuff_API(BundleAPI):
                         return {
                             'model': AtomicStructureArg,
                             'blenderPath': FileNameArg,
-                            'scriptOnly': BoolArg
+                            'scriptOnly': BoolArg,
+                            'coordsets': BoolArg,
+                            'frameRate': FloatArg,
+                            'segments': IntArg,
+                            'rings': IntArg,
+                            'triangleBudget': IntArg,
+                            'merge': BoolArg,
+                            'background': BoolArg,
+                            'batch': BoolArg,
                         }
                     
                     def save_args_widget(self, session):
@@ -166,7 +195,10 @@ class _ora_stuff_API(BundleAPI):
                         layout.addRow("blender executable", blender)
     
                         script_only = QCheckBox()
-                        layout.addRow("python script only", script_only)
+                        layout.addRow("blender python script only", script_only)
+                        
+                        coordsets = QCheckBox()
+                        layout.addRow("animate coordinate sets", coordsets)
                         
                         return widget
     
@@ -175,16 +207,21 @@ class _ora_stuff_API(BundleAPI):
                         models = widget.layout().itemAt(0).widget().options_string()
                         blender = widget.layout().itemAt(1, QFormLayout.FieldRole).widget().text()
                         script_only = widget.layout().itemAt(2, QFormLayout.FieldRole).widget().isChecked()
+                        coordsets = widget.layout().itemAt(3, QFormLayout.FieldRole).widget().isChecked()
                         args = [
                             models.replace("models", "model", 1),
+                            "coordsets", str(coordsets),
                         ]
-                        if blender and not script_only:
+                        # with no blender executable, the FBX file is
+                        # written without blender
+                        if script_only:
+                            args.extend(["scriptOnly", "true"])
+                        elif blender:
                             args.extend([
                                 "blenderPath", '"' + blender + '"',
                                 "scriptOnly", "false",
+                                "background", "true",
                             ])
-                        else:
-                            args.extend(["scriptOnly", "true"])
                         return " ".join(args)
 
                 return Info()
@@ -0,0 +1,654 @@
+from chimerax.atomic import Atoms
+from chimerax.core.triggerset import DEREGISTER
+
+import numpy as np
+
+# pseudobond groups used for bond orders
+bond_order_names = [
+    "half",
+    "single",
+    "aromatic",
+    "partial double",
+    "double",
+    "triple",
+]
+
+
+# BondOrderTimeline keys are pair id << _START_BITS | first coordset id
+_START_BITS = 32
+
+
+def _pair(atom1, atom2):
+    return frozenset((atom1, atom2))
+
+
+class BondOrderIndex:
+    """
+    maps pairs of atoms to the covalent bond between them and to the
+    bond order pseudobond between them in each coordinate set
+    bond order pseudobonds should be added and removed with set_bond_order
+    so the index doesn't need to be rebuilt
+    """
+    def __init__(self, structure):
+        self.structure = structure
+        # pair of atoms -> Bond
+        self._bonds = dict()
+        # coordset id -> pair of atoms -> Pseudobond
+        self._pseudobonds = dict()
+        # pseudobonds that were added through the index since the
+        # last time the structure changed
+        self._added = set()
+        self._stale = True
+        self._handler = structure.triggers.add_handler("changes", self._structure_changed)
+
+    def _build(self):
+        structure = self.structure
+        self._bonds = dict()
+        bonds = structure.bonds
+        if len(bonds):
+            for a1, a2, bond in zip(*bonds.atoms, bonds):
+                self._bonds[_pair(a1, a2)] = bond
+
+        self._pseudobonds = dict()
+        for name in bond_order_names:
+            pbg = structure.pseudobond_group(name, create_type=None)
+            if not pbg:
+                continue
+            for cs_id in structure.coordset_ids:
+                pbonds = pbg.get_pseudobonds(cs_id)
+                if not len(pbonds):
+                    continue
+                frame_pseudobonds = self._pseudobonds.setdefault(cs_id, dict())
+                for a1, a2, pb in zip(*pbonds.atoms, pbonds):
+                    frame_pseudobonds[_pair(a1, a2)] = pb
+        self._stale = False
+
+    def _structure_changed(self, trigger_name, data):
+        structure, changes = data
+        if structure.deleted:
+            return DEREGISTER
+        added = self._added
+        self._added = set()
+        if self._stale:
+            return
+        for bond in changes.created_bonds():
+            self._bonds[_pair(*bond.atoms)] = bond
+        # pseudobonds added some other way can't be put in the index
+        # because the coordinate set they belong to isn't known
+        for pb in changes.created_pseudobonds():
+            if pb not in added and pb.group.name in bond_order_names:
+                self._stale = True
+                break
+
+    def bond(self, atom1, atom2):
+        """
+        the covalent bond between atom1 and atom2, or None
+        """
+        if self._stale:
+            self._build()
+        bond = self._bonds.get(_pair(atom1, atom2))
+        if bond is not None and bond.deleted:
+            del self._bonds[_pair(atom1, atom2)]
+            return None
+        return bond
+
+    def delete_bond(self, atom1, atom2):
+        """
+        delete the covalent bond between atom1 and atom2 if there is one
+        """
+        bond = self.bond(atom1, atom2)
+        if bond is not None:
+            del self._bonds[_pair(atom1, atom2)]
+            bond.delete()
+
+    def pseudobond(self, atom1, atom2, cs_id):
+        """
+        the bond order pseudobond between atom1 and atom2 in
+        coordinate set cs_id, or None
+        """
+        if self._stale:
+            self._build()
+        frame_pseudobonds = self._pseudobonds.get(cs_id, dict())
+        pb = frame_pseudobonds.get(_pair(atom1, atom2))
+        if pb is not None and pb.deleted:
+            del frame_pseudobonds[_pair(atom1, atom2)]
+            return None
+        return pb
+
+    def set_bond_order(self, atom1, atom2, cs_id, name):
+        """
+        make the bond order pseudobond between atom1 and atom2 in
+        coordinate set cs_id a member of the name group
+        pseudobonds in other bond order groups are removed
+        name - one of bond_order_names or "broken" to only remove pseudobonds
+        returns the pseudobond, or None for broken bonds
+        """
+        pb = self.pseudobond(atom1, atom2, cs_id)
+        if pb is not None:
+            if pb.group.name == name:
+                return pb
+            pb.group.delete_pseudobond(pb)
+            del self._pseudobonds[cs_id][_pair(atom1, atom2)]
+        if name == "broken":
+            return None
+        pbg = self.structure.pseudobond_group(name, create_type=2)
+        pb = pbg.new_pseudobond(atom1, atom2, cs_id=cs_id)
+        self._pseudobonds.setdefault(cs_id, dict())[_pair(atom1, atom2)] = pb
+        self._added.add(pb)
+        return pb
+
+    def clear_coordset(self, cs_id):
+        """
+        delete all bond order pseudobonds in coordinate set cs_id
+        """
+        if self._stale:
+            self._build()
+        for pb in self._pseudobonds.pop(cs_id, dict()).values():
+            if not pb.deleted:
+                pb.delete()
+
+
+def bond_order_index(structure):
+    """
+    returns the BondOrderIndex for structure, creating it if
+    it doesn't have one yet
+    """
+    index = getattr(structure, "_ora_bond_order_index", None)
+    if index is None:
+        index = BondOrderIndex(structure)
+        structure._ora_bond_order_index = index
+    return index
+
+
+class BondOrderTimeline:
+    """
+    bond orders of pairs of atoms over a structure's coordinate sets
+    each pair has runs of coordinate sets with the same bond order
+    codes are 0 for no bond order, or 1 + the index in bond_order_names
+    bond order pseudobonds are only made for the active coordinate set,
+    except while a session is being saved - then every coordinate set gets
+    its pseudobonds so the bond orders are restored with the session
+    """
+    def __init__(self, structure):
+        self.structure = structure
+        # pair of atoms -> pair id
+        self._pair_ids = dict()
+        self._atoms1 = []
+        self._atoms2 = []
+        self._pair_atoms = None
+        # each run's pair id and first coordset id (see _START_BITS) and
+        # bond order code, sorted by pair and then by coordset
+        # a pair's bond order is 0 before its first run
+        self._run_keys = np.zeros(0, dtype=np.int64)
+        self._run_codes = np.zeros(0, dtype=np.int8)
+        # coordset with pseudobonds and the codes of those pseudobonds
+        self._shown_cs = None
+        self._shown = np.zeros(0, dtype=np.int8)
+        self._adopt_pseudobonds()
+        self._handler = structure.triggers.add_handler("changes", self._structure_changed)
+        self._session_handlers = [
+            structure.session.triggers.add_handler("begin save session", self._begin_save_session),
+            structure.session.triggers.add_handler("end save session", self._end_save_session),
+        ]
+
+    def _adopt_pseudobonds(self):
+        """
+        move bond order pseudobonds the structure already has
+        (e.g. from a session) into the timeline
+        """
+        structure = self.structure
+        index = bond_order_index(structure)
+        if index._stale:
+            index._build()
+        if not index._pseudobonds:
+            return
+        coordset_ids = structure.coordset_ids
+        frame_codes = []
+        for cs_id in coordset_ids:
+            frame_pseudobonds = index._pseudobonds.get(cs_id, dict())
+            pb_list = [pb for pb in frame_pseudobonds.values() if not pb.deleted]
+            pair_ids = self.pair_ids(
+                [pb.atoms[0] for pb in pb_list], [pb.atoms[1] for pb in pb_list],
+            )
+            frame_codes.append((pair_ids, [
+                1 + bond_order_names.index(pb.group.name) for pb in pb_list
+            ]))
+        codes = np.zeros((len(coordset_ids), len(self._atoms1)), dtype=np.int8)
+        for row, (pair_ids, pair_codes) in zip(codes, frame_codes):
+            row[pair_ids] = pair_codes
+        self.set_runs(np.arange(len(self._atoms1)), coordset_ids, coordset_ids[-1] + 1, codes)
+        for cs_id in coordset_ids:
+            if cs_id != structure.active_coordset_id:
+                index.clear_coordset(cs_id)
+
+    def _structure_changed(self, trigger_name, data):
+        structure, changes = data
+        if structure.deleted:
+            return DEREGISTER
+        if changes.num_deleted_atoms():
+            self._remove_deleted_pairs()
+        if "active_coordset changed" in changes.structure_reasons():
+            self.update_pseudobonds()
+
+    def _remove_deleted_pairs(self):
+        """
+        forget pairs with deleted atoms
+        the other pairs are renumbered
+        """
+        keep = np.array([
+            not (a1.deleted or a2.deleted) for a1, a2 in zip(self._atoms1, self._atoms2)
+        ], dtype=bool)
+        if keep.all():
+            return
+        new_ids = np.cumsum(keep) - 1
+        run_pairs = self._run_keys >> _START_BITS
+        kept_runs = keep[run_pairs]
+        # renumbering keeps the runs sorted
+        self._run_keys = self._keys(
+            new_ids[run_pairs[kept_runs]],
+            self._run_keys[kept_runs] & ((1 << _START_BITS) - 1),
+        )
+        self._run_codes = self._run_codes[kept_runs]
+        self._atoms1 = [atom for atom, k in zip(self._atoms1, keep) if k]
+        self._atoms2 = [atom for atom, k in zip(self._atoms2, keep) if k]
+        self._pair_ids = {
+            _pair(a1, a2): i for i, (a1, a2) in enumerate(zip(self._atoms1, self._atoms2))
+        }
+        self._pair_atoms = None
+        self._shown = self._shown[keep[:len(self._shown)]]
+
+    def _begin_save_session(self, trigger_name, session):
+        structure = self.structure
+        if structure.deleted:
+            return DEREGISTER
+        # frames that haven't been read from the SDF file don't have
+        # their bond orders in the timeline yet
+        from ora_stuff.io import load_coordsets
+        load_coordsets(structure)
+        # the changes trigger might not have fired since atoms were deleted
+        self._remove_deleted_pairs()
+        index = bond_order_index(structure)
+        atoms1, atoms2 = self._atoms1, self._atoms2
+        for cs_id in structure.coordset_ids:
+            if cs_id == self._shown_cs:
+                continue
+            codes = self.codes(cs_id)
+            for pair_id in np.flatnonzero(codes):
+                index.set_bond_order(
+                    atoms1[pair_id],
+                    atoms2[pair_id],
+                    cs_id,
+                    bond_order_code_names[codes[pair_id]],
+                )
+
+    def _end_save_session(self, trigger_name, session):
+        structure = self.structure
+        if structure.deleted:
+            return DEREGISTER
+        index = bond_order_index(structure)
+        for cs_id in structure.coordset_ids:
+            if cs_id != self._shown_cs:
+                index.clear_coordset(cs_id)
+
+    @staticmethod
+    def _keys(pair_ids, cs_ids):
+        return (np.asarray(pair_ids, dtype=np.int64) << _START_BITS) | np.asarray(cs_ids, dtype=np.int64)
+
+    @property
+    def n_pairs(self):
+        return len(self._atoms1)
+
+    @property
+    def n_runs(self):
+        return len(self._run_keys)
+
+    def pair_ids(self, atoms1, atoms2):
+        """
+        returns the id of each pair of atoms
+        pairs that aren't in the timeline are added
+        """
+        out = []
+        for a1, a2 in zip(atoms1, atoms2):
+            key = _pair(a1, a2)
+            try:
+                out.append(self._pair_ids[key])
+            except KeyError:
+                self._pair_ids[key] = len(self._atoms1)
+                out.append(len(self._atoms1))
+                self._atoms1.append(a1)
+                self._atoms2.append(a2)
+                self._pair_atoms = None
+        return np.array(out, dtype=int)
+
+    def pair_atoms(self):
+        """
+        returns Atoms for the first and second atom of each pair
+        """
+        if self._pair_atoms is None:
+            self._pair_atoms = (Atoms(self._atoms1), Atoms(self._atoms2))
+        return self._pair_atoms
+
+    def codes(self, cs_id, pair_ids=None):
+        """
+        bond order code of each pair (or the pair_ids pairs) in coordinate set cs_id
+        """
+        if pair_ids is None:
+            pair_ids = np.arange(self.n_pairs)
+        pair_ids = np.asarray(pair_ids, dtype=int)
+        codes = np.zeros(len(pair_ids), dtype=np.int8)
+        if not self.n_runs:
+            return codes
+        # the last run of each pair that starts at or before cs_id
+        ndx = np.searchsorted(
+            self._run_keys, self._keys(pair_ids, cs_id), side="right"
+        ) - 1
+        found = ndx >= 0
+        found[found] = (self._run_keys[ndx[found]] >> _START_BITS) == pair_ids[found]
+        codes[found] = self._run_codes[ndx[found]]
+        return codes
+
+    def bonded_pair_ids(self, start, stop):
+        """
+        ids of the pairs that have a bond order in any coordinate set
+        from start up to (but not including) stop
+        """
+        run_pairs = self._run_keys >> _START_BITS
+        run_starts = self._run_keys & ((1 << _START_BITS) - 1)
+        # each run lasts until the next run of the same pair
+        run_stops = np.full(self.n_runs, np.iinfo(np.int64).max)
+        same_pair = run_pairs[1:] == run_pairs[:-1]
+        run_stops[:-1][same_pair] = run_starts[1:][same_pair]
+        overlaps = (self._run_codes != 0) & (run_starts < stop) & (run_stops > start)
+        return np.unique(run_pairs[overlaps]).astype(int)
+
+    def set_runs(self, pair_ids, starts, stop, codes, changes=None):
+        """
+        set the bond orders of pairs for coordinate sets from starts[0]
+        up to (but not including) stop
+        pair_ids - unique pair ids
+        starts - sorted coordset ids, codes[k] is used from starts[k]
+                 until starts[k + 1]
+        codes - len(starts) x len(pair_ids) array of bond order codes
+        changes - if given, codes are only for starts[0] and changes[k] is
+                  the indices of the pairs that change at starts[k + 1]
+                  and their new codes
+        """
+        pair_ids = np.asarray(pair_ids, dtype=int)
+        starts = np.asarray(starts, dtype=int)
+        if not len(pair_ids) or not len(starts):
+            return
+        if changes is not None:
+            cols = [np.arange(len(pair_ids)), *(changed for changed, _ in changes)]
+            rows = np.repeat(np.arange(len(cols)), [len(changed) for changed in cols])
+            self._splice(
+                pair_ids,
+                starts[0],
+                stop,
+                self._keys(pair_ids[np.concatenate(cols)], starts[rows]),
+                np.concatenate([
+                    np.asarray(codes, dtype=np.int8).reshape(len(pair_ids)),
+                    *(changed_codes for _, changed_codes in changes),
+                ]).astype(np.int8),
+            )
+            return
+        codes = np.asarray(codes, dtype=np.int8).reshape(len(starts), len(pair_ids))
+        # new runs start where a pair's bond order changes
+        changed = np.ones(codes.shape, dtype=bool)
+        changed[1:] = codes[1:] != codes[:-1]
+        rows, cols = np.nonzero(changed)
+        self._splice(
+            pair_ids,
+            starts[0],
+            stop,
+            self._keys(pair_ids[cols], starts[rows]),
+            codes[rows, cols],
+        )
+
+    def _splice(self, pair_ids, start, stop, new_keys, new_codes):
+        """
+        replace the runs of pair_ids from start up to (but not including)
+        stop with new runs
+        new_keys, new_codes - runs of pair_ids that start in that range
+                              if two runs have the same key, the last one is used
+        """
+        # bond orders after the range stay the same
+        after = self.codes(stop, pair_ids)
+        # each pair's runs from start through stop are replaced
+        # these are contiguous in _run_keys
+        lo = np.searchsorted(self._run_keys, self._keys(pair_ids, start))
+        hi = np.searchsorted(self._run_keys, self._keys(pair_ids, stop), side="right")
+        # only runs in the window around the replaced runs are changed
+        window_start = lo.min()
+        window_stop = hi.max()
+        replaced = np.zeros(window_stop - window_start + 1, dtype=int)
+        np.add.at(replaced, lo - window_start, 1)
+        np.add.at(replaced, hi - window_start, -1)
+        keep = np.cumsum(replaced[:-1]) == 0
+        new_keys = np.concatenate([new_keys, self._keys(pair_ids, stop)])
+        new_codes = np.concatenate([new_codes, after])
+        order = np.argsort(new_keys, kind="stable")
+        new_keys = new_keys[order]
+        new_codes = new_codes[order]
+        last = np.ones(len(new_keys), dtype=bool)
+        last[:-1] = new_keys[:-1] != new_keys[1:]
+        new_keys = new_keys[last]
+        new_codes = new_codes[last]
+        keys = self._run_keys[window_start:window_stop][keep]
+        ndx = np.searchsorted(keys, new_keys)
+        keys = np.insert(keys, ndx, new_keys)
+        run_codes = np.insert(
+            self._run_codes[window_start:window_stop][keep], ndx, new_codes
+        )
+        # the run before the window might have the same pair
+        before = 0
+        if window_start and (self._run_keys[window_start - 1] >> _START_BITS) == (keys[0] >> _START_BITS):
+            before = self._run_codes[window_start - 1]
+        keys, run_codes = _drop_repeated_runs(keys, run_codes, before=before)
+        self._run_keys = np.concatenate([
+            self._run_keys[:window_start], keys, self._run_keys[window_stop:],
+        ])
+        self._run_codes = np.concatenate([
+            self._run_codes[:window_start], run_codes, self._run_codes[window_stop:],
+        ])
+        self.update_pseudobonds(pair_ids)
+
+    def _selected_runs(self, old_ids):
+        """
+        returns the pair id, new coordset id, and bond order code of the runs
+        for coordinate sets old_ids when they are renumbered 1, 2, ...
+        old_ids - coordset ids, increasing or decreasing
+        """
+        old_ids = np.asarray(old_ids, dtype=np.int64)
+        run_pairs = self._run_keys >> _START_BITS
+        run_starts = self._run_keys & ((1 << _START_BITS) - 1)
+        first = np.ones(self.n_runs, dtype=bool)
+        first[1:] = run_pairs[1:] != run_pairs[:-1]
+        # each run lasts until the next run of the same pair
+        run_stops = np.full(self.n_runs, np.iinfo(np.int64).max)
+        run_stops[:-1][~first[1:]] = run_starts[1:][~first[1:]]
+        # pairs don't have a bond order before their first run
+        run_pairs = np.concatenate([run_pairs, run_pairs[first]])
+        run_stops = np.concatenate([run_stops, run_starts[first]])
+        run_starts = np.concatenate([run_starts, np.zeros(first.sum(), dtype=np.int64)])
+        run_codes = np.concatenate([self._run_codes, np.zeros(first.sum(), dtype=np.int8)])
+        
+        # new coordsets in each run are contiguous
+        decreasing = len(old_ids) > 1 and old_ids[0] > old_ids[-1]
+        ascending = old_ids[::-1] if decreasing else old_ids
+        lo = np.searchsorted(ascending, run_starts)
+        hi = np.searchsorted(ascending, run_stops)
+        if decreasing:
+            new_starts = len(old_ids) - hi + 1
+        else:
+            new_starts = lo + 1
+        used = hi > lo
+        return run_pairs[used], new_starts[used], run_codes[used]
+
+    def copy_runs(self, other, pair_ids, old_ids, start):
+        """
+        copy bond orders from another BondOrderTimeline
+        pair_ids - id in this timeline of each pair in other
+        old_ids - coordset ids in other to copy, increasing or decreasing
+        start - coordset id in this timeline that old_ids[0] is copied to
+        """
+        pair_ids = np.asarray(pair_ids, dtype=int)
+        if not len(pair_ids) or not len(old_ids):
+            return
+        run_pairs, new_starts, run_codes = other._selected_runs(old_ids)
+        # pairs without runs have no bond order
+        self._splice(
+            pair_ids,
+            start,
+            start + len(old_ids),
+            np.concatenate([
+                self._keys(pair_ids, start),
+                self._keys(pair_ids[run_pairs], new_starts + start - 1),
+            ]),
+            np.concatenate([np.zeros(len(pair_ids), dtype=np.int8), run_codes]),
+        )
+
+    def remap_coordsets(self, old_ids):
+        """
+        move the bond orders to new coordinate sets after the structure's
+        coordinate sets are replaced (e.g. by trimming or reversing)
+        old_ids - old coordset id of each new coordset (1, 2, ...);
+                  must be increasing or decreasing
+        """
+        old_ids = np.asarray(old_ids, dtype=np.int64)
+        # pseudobonds are remade for the new active coordinate set
+        if self._shown_cs is not None:
+            bond_order_index(self.structure).clear_coordset(self._shown_cs)
+            self._shown_cs = None
+        
+        run_pairs, new_starts, run_codes = self._selected_runs(old_ids)
+        keys = self._keys(run_pairs, new_starts)
+        order = np.argsort(keys)
+        self._run_keys, self._run_codes = _drop_repeated_runs(
+            keys[order], run_codes[order]
+        )
+        self.update_pseudobonds()
+
+    def set_bond_order(self, atom1, atom2, name, start, stop):
+        """
+        set the bond order of atom1 and atom2 for coordinate sets start
+        up to (but not including) stop
+        name - one of bond_order_names or "broken"
+        """
+        self.set_runs(
+            self.pair_ids([atom1], [atom2]),
+            [start],
+            stop,
+            [[bond_order_code(name)]],
+        )
+
+    def update_pseudobonds(self, pair_ids=None):
+        """
+        make the bond order pseudobonds of the active coordinate set
+        match the timeline
+        pair_ids - only these pairs have changed since the last update
+        """
+        structure = self.structure
+        cs_id = structure.active_coordset_id
+        index = bond_order_index(structure)
+        shown = np.zeros(self.n_pairs, dtype=np.int8)
+        if cs_id != self._shown_cs:
+            if self._shown_cs is not None:
+                index.clear_coordset(self._shown_cs)
+            pair_ids = np.arange(self.n_pairs)
+        else:
+            shown[:len(self._shown)] = self._shown
+            if pair_ids is None:
+                pair_ids = np.arange(self.n_pairs)
+        pair_ids = np.asarray(pair_ids, dtype=int)
+        codes = self.codes(cs_id, pair_ids)
+        changed = codes != shown[pair_ids]
+        for pair_id, code in zip(pair_ids[changed], codes[changed]):
+            atom1 = self._atoms1[pair_id]
+            atom2 = self._atoms2[pair_id]
+            # atoms can be deleted before the structure's changes
+            # trigger removes their pairs
+            if atom1.deleted or atom2.deleted:
+                continue
+            index.set_bond_order(atom1, atom2, cs_id, bond_order_code_names[code])
+        shown[pair_ids] = codes
+        self._shown_cs = cs_id
+        self._shown = shown
+        if changed.any():
+            style_bond_order_groups(structure)
+
+
+def _drop_repeated_runs(keys, codes, before=0):
+    """
+    remove runs that have the same bond order as the pair's previous run
+    keys, codes - sorted BondOrderTimeline runs
+    before - bond order of the run before keys[0] if it has the same pair
+    """
+    run_pairs = keys >> _START_BITS
+    previous = np.zeros(len(keys), dtype=np.int8)
+    previous[1:] = codes[:-1]
+    previous[1:][run_pairs[1:] != run_pairs[:-1]] = 0
+    if len(keys):
+        previous[0] = before
+    needed = codes != previous
+    return keys[needed], codes[needed]
+
+
+# name of each BondOrderTimeline code
+bond_order_code_names = ["broken", *bond_order_names]
+
+
+def bond_order_code(name):
+    """
+    BondOrderTimeline code for a bond order name
+    """
+    return bond_order_code_names.index(name)
+
+
+def bond_order_timeline(structure):
+    """
+    returns the BondOrderTimeline for structure, creating it if
+    it doesn't have one yet
+    """
+    timeline = getattr(structure, "_ora_bond_orders", None)
+    if timeline is None:
+        timeline = BondOrderTimeline(structure)
+        structure._ora_bond_orders = timeline
+    return timeline
+
+
+def bond_order_styles():
+    """
+    returns a dict of the mouse mode for each bond order name, which
+    has the color and dashes for that bond order
+    """
+    from ora_stuff.mouse_modes import (
+        SetHalfBond,
+        SetSingleBond,
+        SetAromaticBond,
+        SetPartialDoubleBond,
+        SetDoubleBond,
+        SetTripleBond,
+    )
+    return dict(zip(
+        bond_order_names,
+        [SetHalfBond, SetSingleBond, SetAromaticBond, SetPartialDoubleBond, SetDoubleBond, SetTripleBond]
+    ))
+
+
+def style_bond_order_groups(structure):
+    """
+    set the color and dashes of the bond order pseudobond groups
+    """
+    for bo_pbg, style in bond_order_styles().items():
+        pbg = structure.pseudobond_group(
+            bo_pbg,
+            create_type=None,
+        )
+        if pbg is None:
+            continue
+        pbg.dashes = style.dashes
+        # bug in older versions of ChimeraX where new pseudobonds aren't
+        # displayed until something else changes
+        pbg.dashes += 2
+        pbg.dashes -= 2
+        pbg.color = style.color
@@ -0,0 +1,30 @@
+from chimerax.core.commands import CmdDesc
+
+from ora_stuff.io import blender_jobs
+
+blenderJobs_description = CmdDesc(
+    synopsis="list FBX exports that are running or waiting to run in blender",
+)
+
+blenderJobs_stop_description = CmdDesc(
+    synopsis="stop FBX exports that are running or waiting to run in blender",
+)
+
+
+def blenderJobs(session):
+    """
+    log the blender jobs started by save fbx background true
+    """
+    if not blender_jobs:
+        session.logger.info("no blender jobs")
+        return
+    for job in blender_jobs:
+        session.logger.info(job.describe())
+
+
+def blenderJobs_stop(session):
+    """
+    stop blender jobs started by save fbx background true
+    """
+    while blender_jobs:
+        blender_jobs.pop().cancel()
@@ -1,8 +1,11 @@
-from chimerax.atomic import AtomicStructureArg, AtomicStructuresArg
-from chimerax.core.commands import IntArg, CmdDesc, run
+from chimerax.atomic import AtomicStructureArg, AtomicStructuresArg, AtomsArg
+from chimerax.core.commands import FloatArg, IntArg, CmdDesc
 
 import numpy as np
 
+from ora_stuff.bond_orders import bond_order_timeline
+from ora_stuff.io import load_coordsets
+
 trim_cs_description = CmdDesc(
     required=[("selection", AtomicStructureArg)],
     keyword=[
@@ -17,6 +20,24 @@ flip_cs_description = CmdDesc(
     synopsis="reverse a trajectory",
 )
 
+decimate_cs_description = CmdDesc(
+    required=[("selection", AtomicStructureArg)],
+    keyword=[
+        ("rmsd", FloatArg),
+        ("frames", IntArg),
+    ],
+    synopsis="keep only frames that are different enough from each other",
+)
+
+align_cs_description = CmdDesc(
+    required=[("selection", AtomicStructureArg)],
+    keyword=[
+        ("reference", IntArg),
+        ("atoms", AtomsArg),
+    ],
+    synopsis="superimpose every frame of a trajectory onto one frame",
+)
+
 combine_cs_description = CmdDesc(
     required=[
         ("selection", AtomicStructuresArg),
@@ -24,16 +45,35 @@ combine_cs_description = CmdDesc(
     synopsis="combine coordinate sets into a new structure",
 )
 
+def _coordset_array(structure, coordset_ids, out=None):
+    """
+    returns the coordinates of the coordset_ids coordinate sets
+    as one n_coordsets x n_atoms x 3 array
+    out - array to put the coordinates in
+    """
+    coords = out
+    if coords is None:
+        coords = np.empty((len(coordset_ids), structure.num_atoms, 3))
+    for frame_coords, cs_id in zip(coords, coordset_ids):
+        frame_coords[:] = structure.coordset(cs_id).xyzs
+    return coords
+
+def _replace_coordsets(structure, coordset_ids):
+    """
+    replace the structure's coordinate sets with the coordset_ids coordinate
+    sets, in that order, and move the bond orders with them
+    coordset_ids must be increasing or decreasing
+    """
+    load_coordsets(structure)
+    timeline = bond_order_timeline(structure)
+    structure.add_coordsets(_coordset_array(structure, coordset_ids), replace=True)
+    timeline.remap_coordsets(coordset_ids)
+
 def flip_cs(
     session,
     selection,
 ):
-    current_coords = []
-    for cs_id in selection.coordset_ids:
-        current_coords.append(selection.coordset(cs_id).xyzs)
-    current_coords.reverse()
-    coords = np.array(current_coords)
-    selection.add_coordsets(coords, replace=True)
+    _replace_coordsets(selection, selection.coordset_ids[::-1])
 
 def trim_cs(
     session,
@@ -41,11 +81,145 @@ def trim_cs(
     first=0,
     last=0,
 ):
-    current_coords = []
-    for cs_id in selection.coordset_ids[first : selection.num_coordsets - last]:
-        current_coords.append(selection.coordset(cs_id).xyzs)
-    coords = np.array(current_coords)
+    _replace_coordsets(
+        selection,
+        selection.coordset_ids[first : selection.num_coordsets - last],
+    )
+
+def _rmsd(coords, ref_coords):
+    """
+    RMSD between each frame in coords (n_frames x n_atoms x 3) and ref_coords
+    coordinates are not aligned first
+    """
+    return np.sqrt(np.mean(np.sum((coords - ref_coords) ** 2, axis=-1), axis=-1))
+
+def _rmsd_keyframes(coords, threshold, chunk_size=256):
+    """
+    indices of the frames with an RMSD of more than threshold to the
+    last frame that was kept
+    the first and last frames are always kept
+    """
+    keep = [0]
+    start = 1
+    while start < len(coords):
+        # only a chunk of frames is compared at a time, as the
+        # next keyframe is usually close by
+        rmsd = _rmsd(coords[start:start + chunk_size], coords[keep[-1]])
+        far = np.flatnonzero(rmsd > threshold)
+        if len(far):
+            keep.append(start + far[0])
+            start += far[0] + 1
+        else:
+            start += chunk_size
+    if keep[-1] != len(coords) - 1:
+        keep.append(len(coords) - 1)
+    return np.array(keep)
+
+def _spread_keyframes(coords, n_frames):
+    """
+    indices of n_frames frames that are spread out as much as possible
+    each frame that is picked has the largest RMSD to the closest frame
+    that has already been picked, starting with the first and last frames
+    """
+    n_frames = min(n_frames, len(coords))
+    # squared distances are |a|^2 + |b|^2 - 2 a.b, so each frame
+    # that is picked only needs one matrix-vector product
+    flat = coords.reshape(len(coords), -1)
+    sq_norms = np.sum(flat ** 2, axis=1)
+    
+    def sq_dist(ndx):
+        return np.maximum(sq_norms + sq_norms[ndx] - 2 * flat.dot(flat[ndx]), 0)
+    
+    keep = [0, len(coords) - 1][:n_frames]
+    closest = np.minimum(sq_dist(0), sq_dist(len(coords) - 1))
+    while len(keep) < n_frames:
+        ndx = int(np.argmax(closest))
+        keep.append(ndx)
+        closest = np.minimum(closest, sq_dist(ndx))
+    return np.unique(keep)
+
+def decimate_cs(
+    session,
+    selection,
+    rmsd=None,
+    frames=None,
+):
+    """
+    keep only some of the frames of a trajectory
+    rmsd - keep frames with an RMSD (in angstroms, without alignment) of more
+           than this to the previous frame that was kept
+    frames - keep this many frames that are as different from each other as possible
+    the first and last frames are always kept
+    """
+    if (rmsd is None) == (frames is None):
+        session.logger.error("either rmsd or frames must be given")
+        return
+    load_coordsets(selection)
+    coordset_ids = selection.coordset_ids
+    coords = _coordset_array(selection, coordset_ids)
+    if rmsd is not None:
+        keep = _rmsd_keyframes(coords, rmsd)
+    else:
+        keep = _spread_keyframes(coords, max(frames, 1))
+    session.logger.info("keeping %i of %i coordinate sets" % (len(keep), len(coordset_ids)))
+    timeline = bond_order_timeline(selection)
+    selection.add_coordsets(coords[keep], replace=True)
+    timeline.remap_coordsets(np.asarray(coordset_ids)[keep])
+
+def _kabsch_align(coords, ref_coords, fit_atoms=None):
+    """
+    superimpose each frame of coords (n_frames x n_atoms x 3) onto ref_coords
+    fit_atoms - indices of the atoms used for the fit; all atoms are used if
+                this isn't given
+    returns the aligned coordinates
+    """
+    if fit_atoms is None:
+        fit_atoms = slice(None)
+    fit = coords[:, fit_atoms]
+    ref_fit = ref_coords[fit_atoms]
+    centers = fit.mean(axis=1)
+    ref_center = ref_fit.mean(axis=0)
+    # covariance matrix for every frame at once
+    h = np.einsum("fmi,mj->fij", fit - centers[:, np.newaxis], ref_fit - ref_center)
+    u, _, vt = np.linalg.svd(h)
+    # flip the last axis of frames that would be reflected
+    d = np.sign(np.linalg.det(np.matmul(u, vt)))
+    u[:, :, -1] *= d[:, np.newaxis]
+    rotations = np.matmul(u, vt)
+    return np.matmul(coords - centers[:, np.newaxis], rotations) + ref_center
+
+def align_cs(
+    session,
+    selection,
+    reference=None,
+    atoms=None,
+):
+    """
+    superimpose every frame of a trajectory onto one frame
+    reference - coordset id of the frame to superimpose onto;
+                the first coordinate set is used if this isn't given
+    atoms - only use these atoms for the fit
+    """
+    load_coordsets(selection)
+    coordset_ids = selection.coordset_ids
+    if reference is None:
+        reference = coordset_ids[0]
+    if reference not in coordset_ids:
+        session.logger.error("%i is not a coordinate set of %s" % (reference, selection.atomspec))
+        return
+    fit_atoms = None
+    if atoms is not None:
+        fit_atoms = selection.atoms.indices(atoms)
+        fit_atoms = fit_atoms[fit_atoms >= 0]
+        if len(fit_atoms) < 3:
+            session.logger.error("at least 3 atoms of %s are needed for the fit" % selection.atomspec)
+            return
+    coords = _coordset_array(selection, coordset_ids)
+    ref_coords = coords[list(coordset_ids).index(reference)].copy()
+    coords = _kabsch_align(coords, ref_coords, fit_atoms)
+    timeline = bond_order_timeline(selection)
     selection.add_coordsets(coords, replace=True)
+    timeline.remap_coordsets(coordset_ids)
 
 def combine_cs(
     session,
@@ -54,15 +228,33 @@ def combine_cs(
     if not all([selection[0].num_atoms == m.num_atoms for m in selection[1:]]):
         session.logger.error("cannot combine models: different numbers of atoms")
         return
-    for i in range(0, selection[0].num_atoms):
-        if not all([selection[0].atoms[i].element.name == m.atoms[i].element.name for m in selection[1:]]):
-            session.logger.error("cannot combine models: atoms in a different order or molecules are different")
-            return
-    current_coords = []
+    elements = selection[0].atoms.elements.numbers
+    if not all([np.array_equal(elements, m.atoms.elements.numbers) for m in selection[1:]]):
+        session.logger.error("cannot combine models: atoms in a different order or molecules are different")
+        return
+    for m in selection:
+        load_coordsets(m)
+    coords = np.empty((sum(m.num_coordsets for m in selection), selection[0].num_atoms, 3))
+    start = 0
+    for m in selection:
+        _coordset_array(m, m.coordset_ids, out=coords[start:start + m.num_coordsets])
+        start += m.num_coordsets
+    
+    combined = selection[0].copy("combination")
+    session.models.add([combined])
+    combined.add_coordsets(coords, replace=True)
+    
+    # bond orders of each model go to its range of coordinate sets
+    timeline = bond_order_timeline(combined)
+    atoms = combined.atoms
+    start = 1
     for m in selection:
-        for cs_id in m.coordset_ids:
-            current_coords.append(m.coordset(cs_id).xyzs)
-    coords = np.array(current_coords)
-    m = run(session, "combine %s" % selection[0].atomspec)
-    run(session, "mcopy %s toAtoms %s" % (selection[0].atomspec, m.atomspec))
-    m.add_coordsets(coords, replace=True)
+        m_timeline = bond_order_timeline(m)
+        if m_timeline.n_pairs:
+            atoms1, atoms2 = m_timeline.pair_atoms()
+            pair_ids = timeline.pair_ids(
+                atoms.filter(m.atoms.indices(atoms1)),
+                atoms.filter(m.atoms.indices(atoms2)),
+            )
+            timeline.copy_runs(m_timeline, pair_ids, m.coordset_ids, start)
+        start += m.num_coordsets
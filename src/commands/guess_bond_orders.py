@@ -1,21 +1,20 @@
 from chimerax.atomic import PseudobondGroup, AtomsArg, Atoms
-from chimerax.core.commands import IntArg, FloatArg, Or, EnumOf, CmdDesc
+from chimerax.core.commands import BoolArg, IntArg, FloatArg, Or, EnumOf, CmdDesc
+from chimerax.core.triggerset import DEREGISTER
 
 from AaronTools.atoms import BondOrder
 from AaronTools.const import RADII
 
-from scipy.spatial.distance import pdist
+from scipy.spatial import cKDTree
 
 import numpy as np
 
-from ora_stuff.mouse_modes import (
-    SetHalfBond,
-    SetSingleBond,
-    SetAromaticBond,
-    SetPartialDoubleBond,
-    SetDoubleBond,
-    SetTripleBond,
-)
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from ora_stuff.bond_orders import bond_order_code, bond_order_index, bond_order_timeline
+from ora_stuff.io import load_coordsets
 
 guessBondOrders_description = CmdDesc(
     required=[("selection", AtomsArg)],
@@ -23,26 +22,334 @@ guessBondOrders_description = CmdDesc(
         ("coordinateSet", Or(IntArg, EnumOf(["all"]))),
         ("bondTolerance", FloatArg),
         ("TSBondTolerance", FloatArg),
+        ("processes", IntArg),
+        ("background", BoolArg),
+        ("incremental", BoolArg),
     ],
     synopsis="guess bond orders based on the coordinates",
 )
 
+guessBondOrders_stop_description = CmdDesc(
+    synopsis="stop guessing bond orders in the background",
+)
+
+# coordinate sets classified at a time by guessBondOrders coordinateSet all
+GUESS_CHUNK_SIZE = 32
+
+# coordinate sets classified at a time with incremental true
+# the neighbor list is rebuilt for each chunk, and only changes are
+# returned, so these chunks can be larger
+INCREMENTAL_CHUNK_SIZE = 256
+
+# extra distance (in angstroms) used for the neighbor list when bond orders
+# are updated incrementally
+# the list is rebuilt after an atom moves more than half of this
+INCREMENTAL_SKIN = 0.5
+
+# _GuessBondOrdersJob instances that are running in the background
+_background_jobs = []
+
+# bond orders that classify can return, in the order they are applied
+guessed_bond_orders = [
+    "broken",
+    "half",
+    "single",
+    "partial double",
+    "double",
+    "triple",
+]
+
+
+class _BondOrderTables:
+    """
+    thresholds and reference bond lengths for each pair of elements,
+    indexed by element number
+    """
+    def __init__(self, atoms, bo_data, bondTolerance, TSBondTolerance):
+        numbers, first = np.unique(atoms.elements.numbers, return_index=True)
+        names = atoms.elements.names[first]
+        size = numbers.max() + 1
+        # squared distances
+        self.max_connected = np.zeros((size, size))
+        self.max_ts_distance = np.zeros((size, size))
+        # bond orders from AaronTools (e.g. "1.0") and the index of each one
+        # in guessed_bond_orders
+        orders = []
+        pair_lengths = dict()
+        for n1, ele1 in zip(numbers, names):
+            for n2, ele2 in zip(numbers, names):
+                self.max_connected[n1, n2] = (
+                    RADII[ele1] + RADII[ele2] + bondTolerance
+                ) ** 2
+                self.max_ts_distance[n1, n2] = (
+                    RADII[ele1] + RADII[ele2] + TSBondTolerance
+                ) ** 2
+                try:
+                    pair_lengths[(n1, n2)] = bo_data.bonds[bo_data.key(ele1, ele2)]
+                except KeyError:
+                    continue
+                for order in pair_lengths[(n1, n2)]:
+                    if order not in orders:
+                        orders.append(order)
+        
+        codes = {"1.0": 2, "1.5": 3, "2.0": 4, "3.0": 5}
+        self.order_codes = np.array([codes.get(order, -1) for order in orders], dtype=int)
+        self.unanticipated = [order for order in orders if order not in codes]
+        # reference length of each order, inf if there isn't one
+        self.lengths = np.full((size, size, len(orders)), np.inf)
+        self.has_lengths = np.zeros((size, size), dtype=bool)
+        for (n1, n2), lengths in pair_lengths.items():
+            self.has_lengths[n1, n2] = True
+            for order, length in lengths.items():
+                self.lengths[n1, n2, orders.index(order)] = length
+        
+        # distances where the bond order of each pair of elements can change
+        # padded with inf
+        boundaries = dict()
+        for n1 in numbers:
+            for n2 in numbers:
+                finite = np.unique(self.lengths[n1, n2][np.isfinite(self.lengths[n1, n2])])
+                boundaries[(n1, n2)] = [
+                    np.sqrt(self.max_connected[n1, n2]),
+                    np.sqrt(self.max_ts_distance[n1, n2]),
+                    *((finite[1:] + finite[:-1]) / 2),
+                ]
+        self.boundaries = np.full(
+            (size, size, max(len(b) for b in boundaries.values())), np.inf
+        )
+        for (n1, n2), b in boundaries.items():
+            self.boundaries[n1, n2, :len(b)] = b
+        
+        # pairs farther apart than the largest threshold are not bonded
+        # a little extra is added so round off doesn't drop pairs that
+        # are right on the threshold
+        self.cutoff = np.sqrt(max(
+            self.max_connected.max(), self.max_ts_distance.max()
+        )) + 1e-6
+    
+    def classify(self, numbers1, numbers2, distances):
+        """
+        returns the index in guessed_bond_orders for each pair of atoms,
+        or -1 if the closest bond order is not one of those
+        numbers1, numbers2 - element numbers of the atoms in each pair
+        distances - squared distance between the atoms
+        """
+        max_connected = self.max_connected[numbers1, numbers2]
+        max_ts_distance = self.max_ts_distance[numbers1, numbers2]
+        # bonded and one of the atoms is H - can only have single bonds
+        # same if we don't have data for this pair of elements
+        codes = np.full(np.shape(distances), 2)
+        # otherwise, order is guessed based on distance
+        guess = self.has_lengths[numbers1, numbers2] & (numbers1 != 1) & (numbers2 != 1)
+        if len(self.order_codes):
+            diff = np.abs(
+                self.lengths[numbers1, numbers2] - np.sqrt(distances)[..., np.newaxis]
+            )
+            codes = np.where(guess, self.order_codes[np.argmin(diff, axis=-1)], codes)
+        # ts bonded
+        codes[(distances < max_ts_distance) & (distances > max_connected)] = 1
+        # not bonded
+        codes[(distances > max_ts_distance) & (distances > max_connected)] = 0
+        return codes
+    
+    def slack(self, numbers1, numbers2, distances):
+        """
+        how far (in angstroms) each pair can move before its bond order
+        might change
+        distances - distance (not squared) between the atoms
+        """
+        slack = np.min(
+            np.abs(self.boundaries[numbers1, numbers2] - distances[..., np.newaxis]),
+            axis=-1,
+        )
+        # leave some room for round off in classify
+        return np.maximum(slack - 1e-6, 0)
+
+
+class _GuessBondOrdersJob:
+    """
+    guess bond orders for every coordinate set of a structure
+    pairs are classified for chunks of coordinate sets, optionally by a
+    pool of processes, and the bond orders are applied on the main thread
+    """
+    def __init__(
+        self, session, structure, atoms, tables, coordset_ids, processes=1, incremental=False,
+    ):
+        self.session = session
+        self.structure = structure
+        self.atoms = atoms
+        self.tables = tables
+        self.coordset_ids = list(coordset_ids)
+        self.numbers = atoms.elements.numbers
+        self.bonded_pairs = _bonded_pairs(atoms)
+        selected = structure.atoms.indices(atoms)
+        self.coords = np.array([
+            structure.coordset(cs_id).xyzs for cs_id in self.coordset_ids
+        ])[:, selected]
+        self.chunk_size = INCREMENTAL_CHUNK_SIZE if incremental else GUESS_CHUNK_SIZE
+        self.chunk_starts = deque(range(0, len(self.coordset_ids), self.chunk_size))
+        self.in_flight = deque()
+        self.n_done = 0
+        self.pool = None
+        # only a few chunks are queued at once to limit memory use
+        self.max_in_flight = 1
+        if processes > 1:
+            self.pool = ProcessPoolExecutor(
+                max_workers=processes, mp_context=get_context("spawn")
+            )
+            self.max_in_flight = 2 * processes
+        self.warned = False
+        self.incremental = incremental
+        if incremental:
+            self.classify = _classify_frames_incremental
+        else:
+            self.classify = _classify_frames
+
+    def _stop(self, end):
+        """
+        coordset after the chunk of coordinate sets that ends at
+        coordset_ids[end]
+        """
+        if end < len(self.coordset_ids):
+            return self.coordset_ids[end]
+        return self.coordset_ids[-1] + 1
+
+    def _submit(self):
+        while self.chunk_starts and len(self.in_flight) < self.max_in_flight:
+            start = self.chunk_starts.popleft()
+            # splicing in earlier chunks doesn't change the bond orders
+            # of this one, so the pairs can be found before they are applied
+            timeline_pairs = _timeline_pairs(
+                self.structure,
+                self.atoms,
+                self.coordset_ids[start],
+                self._stop(start + self.chunk_size),
+            )
+            args = (
+                self.tables,
+                self.numbers,
+                self.coords[start:start + self.chunk_size],
+                np.concatenate([self.bonded_pairs, timeline_pairs]),
+            )
+            if self.pool is None:
+                self.in_flight.append((start, self.classify(*args)))
+            else:
+                self.in_flight.append((start, self.pool.submit(self.classify, *args)))
+
+    def step(self, block=True):
+        """
+        apply bond orders for the next chunk of coordinate sets
+        block - wait for the chunk to be classified
+        returns False when all coordinate sets are done
+        """
+        if self.structure.deleted:
+            self.cancel()
+            return False
+        self._submit()
+        if not self.in_flight:
+            self.finish()
+            return False
+        start, result = self.in_flight[0]
+        if self.pool is not None:
+            if not block and not result.done():
+                return True
+            result = result.result()
+        self.in_flight.popleft()
+
+        if self.incremental:
+            pairs, codes, changes = result
+            n_frames = len(changes) + 1
+            unanticipated = (codes == -1).any() or any(
+                (changed_codes == -1).any() for _, changed_codes in changes
+            )
+        else:
+            pairs, codes = result
+            changes = None
+            n_frames = len(codes)
+            unanticipated = (codes == -1).any()
+        if not self.warned and unanticipated:
+            self.session.logger.warning("unanticipated bond order: %s. Expected one of %s" % (
+                ", ".join(self.tables.unanticipated), "1.0, 1.5, 2.0, 3.0",
+            ))
+            self.warned = True
+        _apply_bond_orders(
+            self.structure,
+            self.atoms,
+            pairs,
+            codes,
+            self.coordset_ids[start:start + n_frames],
+            self._stop(start + n_frames),
+            changes=changes,
+        )
+        self.n_done += n_frames
+        self.session.logger.status(
+            "guessing bond orders for %s: %i/%i coordinate sets" % (
+                self.structure.atomspec, self.n_done, len(self.coordset_ids),
+            )
+        )
+        return True
+
+    def run(self):
+        while self.step():
+            pass
+
+    def new_frame(self, trigger_name, data):
+        if self not in _background_jobs or not self.step(block=False):
+            return DEREGISTER
+
+    def cancel(self):
+        self.chunk_starts.clear()
+        self.in_flight.clear()
+        self._shutdown(cancel_futures=True)
+        self.session.logger.status(
+            "stopped guessing bond orders for %s after %i/%i coordinate sets" % (
+                self.structure.atomspec, self.n_done, len(self.coordset_ids),
+            )
+        )
+
+    def finish(self):
+        self._shutdown()
+        self.session.logger.status(
+            "guessed bond orders for %i coordinate sets of %s" % (
+                self.n_done, self.structure.atomspec,
+            )
+        )
+
+    def _shutdown(self, cancel_futures=False):
+        if self in _background_jobs:
+            _background_jobs.remove(self)
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=cancel_futures)
+            self.pool = None
+
+
 def guessBondOrders(
     session,
     selection,
     coordinateSet=None,
     bondTolerance=0.35,
     TSBondTolerance=0.6,
+    processes=1,
+    background=False,
+    incremental=False,
 ):
     """
     draw a TS bond
     selection - atoms
     coordinateSet - cd_id to use when guessing bond orders. If not given, current cs_id is used
+    processes - number of processes used to guess bond orders for coordinateSet all
+    background - for coordinateSet all, apply bond orders a chunk of coordinate sets
+                 per graphics frame so the command can be stopped with guessBondOrders stop
+    incremental - for coordinateSet all, only reclassify pairs that moved enough
+                  since the previous coordinate set that their bond order could change
     """
 
     bo_data = BondOrder()
 
     for structure, atoms in selection.by_structure:
+        # bond orders are set for other coordinate sets, so
+        # SDF frames that haven't been read yet need to be loaded
+        load_coordsets(structure)
         if coordinateSet is None:
             coordset_ids = [structure.active_coordset_id]
         elif coordinateSet == "all":
@@ -60,143 +367,257 @@ def guessBondOrders(
                 session.logger.error("expected 'all' or an integer for coordinateSet, got %s" % coordinateSet)
                 return
         
-        max_connected = dict()
-        max_ts_distance = dict()
-        for i, a1 in enumerate(atoms):
-            for a2 in atoms[:i + 1]:
-                key = bo_data.key(a1.element.name, a2.element.name)
-                try:
-                    max_connected[key]
-                except KeyError:
-                    max_connected[key] = (
-                        RADII[a1.element.name] + RADII[a2.element.name] + bondTolerance
-                    ) ** 2
-                    max_ts_distance[key] = (
-                        RADII[a1.element.name] + RADII[a2.element.name] + TSBondTolerance
-                    ) ** 2
+        tables = _BondOrderTables(atoms, bo_data, bondTolerance, TSBondTolerance)
         
-        selected = [structure.atoms.index(a) for a in atoms]
+        if coordinateSet == "all":
+            job = _GuessBondOrdersJob(
+                session,
+                structure,
+                atoms,
+                tables,
+                coordset_ids,
+                processes=processes,
+                incremental=incremental,
+            )
+            if background:
+                _background_jobs.append(job)
+                session.triggers.add_handler("new frame", job.new_frame)
+            else:
+                job.run()
+            continue
         
         for cs_id in coordset_ids:
-            if coordinateSet is None:
-                set_pb_coordsets = structure.coordset_ids
-            elif coordinateSet == "all":
-                set_pb_coordsets = [cs_id]
-            else:
-                set_pb_coordsets = structure.coordset_ids
+            coords = structure.coordset(cs_id).xyzs[structure.atoms.indices(atoms)]
+            pairs, codes = _classify_frames(
+                tables,
+                atoms.elements.numbers,
+                coords[np.newaxis],
+                np.concatenate([
+                    _bonded_pairs(atoms),
+                    _timeline_pairs(
+                        structure,
+                        atoms,
+                        structure.coordset_ids[0],
+                        structure.coordset_ids[-1] + 1,
+                    ),
+                ]),
+            )
+            if (codes == -1).any():
+                session.logger.warning("unanticipated bond order: %s. Expected one of %s" % (
+                    ", ".join(tables.unanticipated), "1.0, 1.5, 2.0, 3.0",
+                ))
+            # the bond orders are used for all coordinate sets
+            _apply_bond_orders(
+                structure,
+                atoms,
+                pairs,
+                codes,
+                structure.coordset_ids[:1],
+                structure.coordset_ids[-1] + 1,
+            )
+
+
+def guessBondOrders_stop(session):
+    """
+    stop guessBondOrders commands that are running in the background
+    """
+    while _background_jobs:
+        _background_jobs.pop().cancel()
+
+
+def _bonded_pairs(atoms):
+    """
+    indices of the atoms in each covalent bond between atoms
+    these are always checked so the bond gets deleted if the atoms
+    are far apart
+    """
+    bonded = atoms.intra_bonds
+    return np.column_stack([
+        atoms.indices(bonded.atoms[0]),
+        atoms.indices(bonded.atoms[1]),
+    ]).reshape(-1, 2)
+
+
+def _timeline_pairs(structure, atoms, start, stop):
+    """
+    indices of the atoms in each pair that has a bond order in the
+    structure's BondOrderTimeline for coordinate sets start up to stop
+    like _bonded_pairs, these are always checked so the bond order gets
+    removed if the atoms are far apart
+    """
+    timeline = bond_order_timeline(structure)
+    pair_ids = timeline.bonded_pair_ids(start, stop)
+    atoms1, atoms2 = timeline.pair_atoms()
+    pairs = np.column_stack([
+        atoms.indices(atoms1[pair_ids]),
+        atoms.indices(atoms2[pair_ids]),
+    ]).reshape(-1, 2)
+    # pairs with atoms that aren't selected are left alone
+    return pairs[(pairs >= 0).all(axis=1)]
+
+
+def _classify_frames(tables, numbers, coords, bonded_pairs):
+    """
+    find bond orders in each frame of coords (n_frames x n_atoms x 3)
+    this is run in worker processes when guessBondOrders uses more
+    than one process
+    returns (i, j) atom pairs with i > j that are close enough to be bonded
+    in any frame (or are in bonded_pairs), and an n_frames x n_pairs
+    array with the index of each pair's bond order in guessed_bond_orders
+    """
+    pairs = [bonded_pairs]
+    for frame_coords in coords:
+        pairs.append(
+            cKDTree(frame_coords).query_pairs(tables.cutoff, output_type="ndarray")
+        )
+    # (i, j) with i > j, in the same order as looping over
+    # atoms and the atoms before them
+    pairs = np.unique(np.sort(np.concatenate(pairs), axis=1)[:, ::-1], axis=0)
+    distances = np.sum(
+        (coords[:, pairs[:, 0]] - coords[:, pairs[:, 1]]) ** 2, axis=-1
+    )
+    codes = tables.classify(numbers[pairs[:, 0]], numbers[pairs[:, 1]], distances)
+    return pairs, codes.astype(np.int8)
+
+
+def _classify_frames_incremental(
+    tables, numbers, coords, bonded_pairs, skin=INCREMENTAL_SKIN
+):
+    """
+    like _classify_frames, but only the changes in bond order between
+    frames are found
+    after the first frame, a pair is only reclassified if its distance has
+    changed enough since it was last checked that it could have crossed
+    a bond order threshold
+    pairs that are farther apart than the cutoff + skin are left out of
+    a neighbor list, which is rebuilt once an atom moves more than skin / 2
+    returns (i, j) atom pairs with i > j, the index of each pair's bond
+    order in guessed_bond_orders for the first frame, and for each later
+    frame the indices of the pairs that changed bond order and their new codes
+    like _classify_frames, pairs that are never within the cutoff and not
+    in bonded_pairs are left out
+    """
+    n_atoms = coords.shape[1]
+    bonded_keys = bonded_pairs.max(axis=1) * n_atoms + bonded_pairs.min(axis=1)
+    # every pair that has been in the neighbor list, as i * n_atoms + j
+    keys = np.zeros(0, dtype=int)
+    key_index = dict()
+    codes = np.zeros(0, dtype=np.int8)
+    ever_bonded = np.zeros(0, dtype=bool)
+    # within the cutoff in any frame
+    ever_close = np.zeros(0, dtype=bool)
+    # distance when each pair was last classified and how far it
+    # can move from there without changing bond order
+    checked = np.zeros(0)
+    slack = np.zeros(0)
+    
+    first_codes = None
+    changes = []
+    reference = None
+    for frame_coords in coords:
+        if reference is None or (
+            np.max(np.sum((frame_coords - reference) ** 2, axis=1)) >= (skin / 2) ** 2
+        ):
+            reference = frame_coords
+            neighbors = cKDTree(frame_coords).query_pairs(
+                tables.cutoff + skin, output_type="ndarray"
+            )
+            neighbor_keys = np.union1d(
+                neighbors.max(axis=1) * n_atoms + neighbors.min(axis=1),
+                bonded_keys,
+            )
+            new_keys = neighbor_keys[~np.isin(neighbor_keys, keys)]
+            for key in new_keys:
+                key_index[key] = len(key_index)
+            keys = np.concatenate([keys, new_keys])
+            codes = np.concatenate([codes, np.zeros(len(new_keys), dtype=np.int8)])
+            ever_bonded = np.concatenate([ever_bonded, np.zeros(len(new_keys), dtype=bool)])
+            ever_close = np.concatenate([ever_close, np.zeros(len(new_keys), dtype=bool)])
+            checked = np.concatenate([checked, np.zeros(len(new_keys))])
+            slack = np.concatenate([slack, np.zeros(len(new_keys))])
+            # pairs that left the neighbor list are not bonded
+            in_list = np.zeros(len(keys), dtype=bool)
+            candidates = np.array(
+                [key_index[key] for key in neighbor_keys], dtype=int
+            )
+            in_list[candidates] = True
+            recheck = candidates
+            left = np.flatnonzero(~in_list & (codes != 0))
+        else:
+            left = np.zeros(0, dtype=int)
+            i, j = np.divmod(keys[candidates], n_atoms)
+            distances = np.linalg.norm(frame_coords[i] - frame_coords[j], axis=1)
+            ever_close[candidates] |= distances <= tables.cutoff
+            recheck = candidates[np.abs(distances - checked[candidates]) >= slack[candidates]]
         
-            coords = structure.coordset(cs_id).xyzs
-            distances = pdist(coords[selected], "sqeuclidean")
-            
-            bonds = {
-                "broken": [],
-                "half": [],
-                "single": [],
-                "partial double": [],
-                "double": [],
-                "triple": [],
-            }
-            
-            for i, a1 in enumerate(atoms):
-                for j, a2 in enumerate(atoms[:i + 1]):
-                    if i == j:
-                        continue
-                    key = bo_data.key(a1.element.name, a2.element.name)
-                    # i, j = sorted([i, j])
-                    ndx = len(atoms) * j + i - ((j + 2) * (j + 1)) // 2
-                    # not bonded
-                    if distances[ndx] > max_ts_distance[key] and TSBondTolerance > bondTolerance:
-                        bonds["broken"].append((a1, a2))
-                        continue
-                    # ts bonded
-                    if distances[ndx] < max_ts_distance[key] and distances[ndx] > max_connected[key]:
-                        bonds["half"].append((a1, a2))
-                        continue
-                    # bonded and one of the atoms is H - can only have single bonds
-                    if a1.element.name == "H" or a2.element.name == "H":
-                        bonds["single"].append((a1, a2))
-                        continue
-                    
-                    # bonded and order is guessed based on distance
-                    # unless we don't have data for this pair of elements
-                    try:
-                        possible_bond_orders = bo_data.bonds[key]
-                    except KeyError:
-                        bonds["single"].append((a1, a2))
-                        continue
-                        
-                    d = np.sqrt(distances[ndx])
-                    closest = (0, None)
-                    for order, length in possible_bond_orders.items():
-                        diff = abs(length - d)
-                        if closest[1] is None or diff < closest[1]:
-                            closest = (order, diff)
-                    
-                    if closest[0] == "1.0":
-                        bonds["single"].append((a1, a2))
-                    elif closest[0] == "1.5":
-                        bonds["partial double"].append((a1, a2))
-                    elif closest[0] == "2.0":
-                        bonds["double"].append((a1, a2))
-                    elif closest[0] == "3.0":
-                        bonds["triple"].append((a1, a2))
-                    else:
-                        session.logger.warning("unanticipated bond order: %s. Expected one of %s" % (
-                            closest[0], "1.0, 1.5, 2.0, 3.0",
-                        ))
-                    
-            for bo in bonds:
-                if not bonds[bo]:
-                    continue
-                
-                if bo != "broken":
-                    pbg = structure.pseudobond_group(
-                        bo,
-                        create_type=2,
-                    )
+        i, j = np.divmod(keys[recheck], n_atoms)
+        distances = np.sum((frame_coords[i] - frame_coords[j]) ** 2, axis=1)
+        new_codes = tables.classify(numbers[i], numbers[j], distances).astype(np.int8)
+        checked[recheck] = np.sqrt(distances)
+        slack[recheck] = tables.slack(numbers[i], numbers[j], checked[recheck])
+        
+        changed = np.concatenate([
+            recheck[new_codes != codes[recheck]], left,
+        ])
+        codes[recheck] = new_codes
+        codes[left] = 0
+        ever_bonded[recheck] |= new_codes != 0
+        ever_close[recheck] |= distances <= tables.cutoff ** 2
+        if first_codes is None:
+            first_codes = codes.copy()
+        else:
+            changes.append((changed, codes[changed]))
+    
+    # pairs added to the neighbor list after the first frame start
+    # out not bonded
+    first_codes = np.concatenate([
+        first_codes, np.zeros(len(keys) - len(first_codes), dtype=np.int8)
+    ])
+    
+    # same pairs and order as _classify_frames
+    # never bonded pairs are kept so their old bond orders get cleared
+    keep = ever_close | ever_bonded | np.isin(keys, bonded_keys)
+    order = np.flatnonzero(keep)[np.argsort(keys[keep])]
+    new_index = np.full(len(keys), -1)
+    new_index[order] = np.arange(len(order))
+    pairs = np.column_stack(np.divmod(keys[order], n_atoms))
+    changes = [
+        (new_index[changed], changed_codes) for changed, changed_codes in changes
+    ]
+    return pairs, first_codes[order], changes
+
+
+def _apply_bond_orders(structure, atoms, pairs, codes, starts, stop, changes=None):
+    """
+    replace covalent bonds between the atom pairs with bond orders
+    in the structure's BondOrderTimeline
+    codes - index of each pair's bond order in guessed_bond_orders
+            for each coordinate set in starts
+    starts - codes[k] are used from coordset starts[k] until starts[k + 1]
+    stop - coordset after the last one that gets bond orders
+    changes - changes from _classify_frames_incremental
+              codes are only for starts[0] if this is given
+    """
+    timeline_codes = np.array(
+        [bond_order_code(bo) for bo in guessed_bond_orders] + [0], dtype=np.int8
+    )
+    index = bond_order_index(structure)
+    classified = (np.atleast_2d(codes) != -1).any(axis=0)
+    if changes is not None:
+        for changed, changed_codes in changes:
+            classified[changed[changed_codes != -1]] = True
+        changes = [
+            (changed, timeline_codes[changed_codes]) for changed, changed_codes in changes
+        ]
+    for a1, a2 in zip(atoms.filter(pairs[classified, 0]), atoms.filter(pairs[classified, 1])):
+        index.delete_bond(a1, a2)
     
-                for (a1, a2) in bonds[bo]:
-                    for bond in structure.bonds:
-                        if a1 in bond.atoms and a2 in bond.atoms:
-                            bond.delete()
-                            break
-                
-                    if bo != "broken":
-                        for cs in set_pb_coordsets:
-                            if coordinateSet == "all" and cs < cs_id:
-                                continue
-                            pbg.new_pseudobond(a1, a2, cs_id=cs)
-
-                            for other_bo in bonds:
-                                if other_bo == bo:
-                                    continue
-                                other_pbg = structure.pseudobond_group(
-                                    other_bo,
-                                    create_type=None,
-                                )
-                                if not other_pbg:
-                                    continue
-
-                                pbs = other_pbg.get_pseudobonds(cs)
-                                for pb in pbs:
-                                    if a1 in pb.atoms and a2 in pb.atoms:
-                                        pb.delete()
-                
-                if bo == "half":
-                    pbg.color = SetHalfBond.color
-                    pbg.dashes = SetHalfBond.dashes
-                elif bo == "single":
-                    pbg.color = SetSingleBond.color
-                    pbg.dashes = SetSingleBond.dashes
-                elif bo == "aromatic":
-                    pbg.color = SetAromaticBond.color
-                    pbg.dashes = SetAromaticBond.dashes
-                elif bo == "partial double":
-                    pbg.color = SetPartialDoubleBond.color
-                    pbg.dashes = SetPartialDoubleBond.dashes
-                elif bo == "double":
-                    pbg.color = SetDoubleBond.color
-                    pbg.dashes = SetDoubleBond.dashes
-                elif bo == "triple":
-                    pbg.color = SetTripleBond.color
-                    pbg.dashes = SetTripleBond.dashes
+    timeline = bond_order_timeline(structure)
+    timeline.set_runs(
+        timeline.pair_ids(atoms.filter(pairs[:, 0]), atoms.filter(pairs[:, 1])),
+        starts,
+        stop,
+        # unanticipated bond orders (-1) are left without a bond order
+        timeline_codes[codes],
+        changes=changes,
+    )
@@ -0,0 +1,862 @@
+import struct
+import zlib
+
+import numpy as np
+
+# binary FBX 7.4, the same version Blender's exporter writes
+FBX_VERSION = 7400
+
+_HEADER = b"Kaydara FBX Binary  \x00\x1a\x00"
+# the file id, creation time, and footer id go together
+# these are the values Blender uses
+_FILE_ID = b"\x28\xb3\x2a\xeb\xb6\x24\xcc\xc2\xbf\xc8\xb0\x2a\xa9\x2b\xfc\xf1"
+_CREATION_TIME = "1970-01-01 10:00:00:000"
+_FOOT_ID = b"\xfa\xbc\xab\x09\xd0\xc8\xd4\x66\xb1\x76\xfb\x83\x1c\xf7\x26\x7e"
+_FOOT_MAGIC = b"\xf8\x5a\x8c\x6a\xde\xf5\xd9\x7e\xec\xe9\x0c\xe3\x75\x8f\x29\x0b"
+_NULL_RECORD = b"\x00" * 13
+
+# arrays with more elements than this are compressed
+_COMPRESS_ARRAY_SIZE = 128
+
+# FBX times are in units of 1/46186158000 s
+FBX_TICKS_PER_SECOND = 46186158000
+# interpolation of animation curve keys
+_INTERPOLATION_CONSTANT = 0x2
+_INTERPOLATION_LINEAR = 0x4
+# limits on the number of segments when the resolution is chosen automatically
+# the most is Blender's default UV sphere
+MIN_SPHERE_SEGMENTS = 8
+MAX_SPHERE_SEGMENTS = 32
+MIN_CYLINDER_SEGMENTS = 6
+MAX_CYLINDER_SEGMENTS = 16
+
+# curve node names for animated properties
+_curve_node_names = {
+    "Lcl Translation": "T",
+    "Lcl Rotation": "R",
+    "Lcl Scaling": "S",
+}
+
+_array_types = {
+    np.dtype(np.float64): b"d",
+    np.dtype(np.float32): b"f",
+    np.dtype(np.int64): b"l",
+    np.dtype(np.int32): b"i",
+    np.dtype(np.bool_): b"b",
+}
+
+
+class FBXNode:
+    """
+    node of an FBX document
+    properties are encoded based on their type:
+    bool - C, np.int16 - Y, int or np.int32 - I, np.int64 - L,
+    np.float32 - F, float - D, str - S, bytes - R,
+    np.ndarray - array of float64, float32, int64, int32, or bool
+    """
+    def __init__(self, name, *properties):
+        self.name = name
+        self.properties = list(properties)
+        self.children = []
+
+    def add(self, name, *properties):
+        """
+        add a child node and return it
+        """
+        child = FBXNode(name, *properties)
+        self.children.append(child)
+        return child
+
+    def encode(self, offset, is_last=False):
+        """
+        returns the bytes for this node when it starts at offset
+        """
+        properties = b"".join(_encode_property(prop) for prop in self.properties)
+        name = self.name.encode("utf-8")
+        children_offset = offset + 13 + len(name) + len(properties)
+        children = []
+        for i, child in enumerate(self.children):
+            data = child.encode(
+                children_offset, is_last=i == len(self.children) - 1
+            )
+            children.append(data)
+            children_offset += len(data)
+        # like the FBX SDK, nodes with children and nodes without
+        # properties end with a null record
+        if self.children or (not self.properties and not is_last):
+            children.append(_NULL_RECORD)
+            children_offset += len(_NULL_RECORD)
+        return b"".join([
+            struct.pack(
+                "<IIIB",
+                children_offset,
+                len(self.properties),
+                len(properties),
+                len(name),
+            ),
+            name,
+            properties,
+            *children,
+        ])
+
+
+def _encode_property(prop):
+    if isinstance(prop, (bool, np.bool_)):
+        return b"C" + struct.pack("<?", bool(prop))
+    if isinstance(prop, np.int16):
+        return b"Y" + struct.pack("<h", prop)
+    if isinstance(prop, np.int64):
+        return b"L" + struct.pack("<q", prop)
+    if isinstance(prop, (int, np.int32)):
+        return b"I" + struct.pack("<i", prop)
+    if isinstance(prop, np.float32):
+        return b"F" + struct.pack("<f", prop)
+    if isinstance(prop, (float, np.float64)):
+        return b"D" + struct.pack("<d", prop)
+    if isinstance(prop, str):
+        data = prop.encode("utf-8")
+        return b"S" + struct.pack("<I", len(data)) + data
+    if isinstance(prop, bytes):
+        return b"R" + struct.pack("<I", len(prop)) + prop
+    if isinstance(prop, np.ndarray):
+        array_type = _array_types[prop.dtype]
+        data = np.ascontiguousarray(prop).astype(prop.dtype.newbyteorder("<")).tobytes()
+        encoding = 0
+        if prop.size > _COMPRESS_ARRAY_SIZE:
+            data = zlib.compress(data, 1)
+            encoding = 1
+        return array_type + struct.pack("<III", prop.size, encoding, len(data)) + data
+    raise TypeError("cannot write %s to an FBX file" % type(prop))
+
+
+def write_fbx(path, nodes):
+    """
+    write a binary FBX file with the top level nodes
+    """
+    data = [_HEADER, struct.pack("<I", FBX_VERSION)]
+    offset = len(_HEADER) + 4
+    for i, node in enumerate(nodes):
+        node_data = node.encode(offset, is_last=i == len(nodes) - 1)
+        data.append(node_data)
+        offset += len(node_data)
+    data.append(_NULL_RECORD)
+    offset += len(_NULL_RECORD)
+
+    data.append(_FOOT_ID)
+    data.append(b"\x00" * 4)
+    offset += len(_FOOT_ID) + 4
+    # pad to a multiple of 16 bytes
+    pad = ((offset + 15) & ~15) - offset
+    if pad == 0:
+        pad = 16
+    data.append(b"\x00" * pad)
+    data.append(struct.pack("<I", FBX_VERSION))
+    data.append(b"\x00" * 120)
+    data.append(_FOOT_MAGIC)
+    with open(path, "wb") as f:
+        f.write(b"".join(data))
+
+
+def _properties70(*properties):
+    """
+    Properties70 node with a P child for each (name, type, label, flags, *values)
+    """
+    node = FBXNode("Properties70")
+    for prop in properties:
+        node.add("P", *prop)
+    return node
+
+
+def _name_class(name, fbx_class):
+    return "%s\x00\x01%s" % (name, fbx_class)
+
+
+def uv_sphere(segments=32, rings=16):
+    """
+    returns the vertices (unit radius), polygon vertex indices in FBX's
+    format (the last index of each polygon is negated and one is subtracted),
+    and normal of each polygon vertex for a UV sphere
+    polygons are counterclockwise when viewed from outside the sphere
+    """
+    # rings of vertices between the poles
+    theta = np.pi * np.arange(1, rings) / rings
+    phi = 2 * np.pi * np.arange(segments) / segments
+    ring_vertices = np.stack([
+        np.outer(np.sin(theta), np.cos(phi)),
+        np.outer(np.sin(theta), np.sin(phi)),
+        np.repeat(np.cos(theta)[:, np.newaxis], segments, axis=1),
+    ], axis=-1).reshape(-1, 3)
+    vertices = np.concatenate([[[0., 0., 1.]], ring_vertices, [[0., 0., -1.]]])
+    bottom = len(vertices) - 1
+
+    def ring(r, s):
+        return 1 + r * segments + s % segments
+
+    s = np.arange(segments)
+    # triangles around the top pole
+    top_tris = np.column_stack([np.zeros(segments, dtype=int), ring(0, s), ring(0, s + 1)])
+    # quads between rings
+    r, s = np.meshgrid(np.arange(rings - 2), np.arange(segments), indexing="ij")
+    r = r.ravel()
+    s = s.ravel()
+    quads = np.column_stack([ring(r, s), ring(r + 1, s), ring(r + 1, s + 1), ring(r, s + 1)])
+    # triangles around the bottom pole
+    s = np.arange(segments)
+    bottom_tris = np.column_stack([np.full(segments, bottom), ring(rings - 2, s + 1), ring(rings - 2, s)])
+
+    polygon_vertices = []
+    for polygons in [top_tris, quads, bottom_tris]:
+        indices = polygons.copy()
+        indices[:, -1] = -indices[:, -1] - 1
+        polygon_vertices.append(indices.ravel())
+    polygon_vertices = np.concatenate(polygon_vertices)
+    normals = vertices[np.concatenate([top_tris.ravel(), quads.ravel(), bottom_tris.ravel()])]
+    return vertices, polygon_vertices, normals
+
+
+def cylinder(segments=16):
+    """
+    returns the vertices, polygon vertex indices in FBX's format, and
+    normal of each polygon vertex for an open cylinder with unit radius
+    and length, centered on the origin with its axis along z
+    (which is FBX's Y axis)
+    """
+    phi = 2 * np.pi * np.arange(segments) / segments
+    circle = np.column_stack([np.cos(phi), np.sin(phi)])
+    vertices = np.concatenate([
+        np.column_stack([circle, np.full(segments, -0.5)]),
+        np.column_stack([circle, np.full(segments, 0.5)]),
+    ])
+    s = np.arange(segments)
+    quads = np.column_stack([s, (s + 1) % segments, segments + (s + 1) % segments, segments + s])
+    normals = vertices[quads.ravel()].copy()
+    normals[:, 2] = 0
+    polygon_vertices = quads.copy()
+    polygon_vertices[:, -1] = -polygon_vertices[:, -1] - 1
+    return vertices, polygon_vertices.ravel(), normals
+
+
+def sphere_triangles(segments, rings):
+    """
+    number of triangles in a UV sphere
+    """
+    return 2 * segments * (rings - 1)
+
+
+def cylinder_triangles(segments):
+    """
+    number of triangles in an open cylinder
+    """
+    return 2 * segments
+
+
+def segments_per_radius(sphere_radii, cylinder_radii, triangle_budget):
+    """
+    returns the number of segments per unit radius that puts about
+    triangle_budget triangles in spheres and cylinders with these radii
+    the number of segments is proportional to the radius so the triangles
+    are about the same size on every sphere and cylinder, and it is limited
+    to the MIN_/MAX_ SPHERE_SEGMENTS and CYLINDER_SEGMENTS
+    spheres have half as many rings as segments
+    """
+    sphere_radii, sphere_counts = np.unique(sphere_radii, return_counts=True)
+    cylinder_radii, cylinder_counts = np.unique(cylinder_radii, return_counts=True)
+
+    def triangles(per_radius):
+        segments = sphere_segments(sphere_radii, per_radius)
+        return (
+            np.dot(sphere_counts, sphere_triangles(segments, segments // 2)) +
+            np.dot(cylinder_counts, cylinder_triangles(cylinder_segments(cylinder_radii, per_radius)))
+        )
+
+    # the number of triangles only changes when a segment count changes,
+    # so bisecting until the interval is small is good enough
+    low = 0.
+    high = 1.
+    while triangles(high) < triangle_budget and high < 1e6:
+        high *= 2
+    while high - low > 1e-3 * high:
+        mid = (low + high) / 2
+        if triangles(mid) > triangle_budget:
+            high = mid
+        else:
+            low = mid
+    return low
+
+
+def sphere_segments(radii, per_radius):
+    """
+    number of segments for spheres with these radii
+    """
+    return np.clip(
+        np.round(per_radius * np.asarray(radii)), MIN_SPHERE_SEGMENTS, MAX_SPHERE_SEGMENTS
+    ).astype(int)
+
+
+def cylinder_segments(radii, per_radius):
+    """
+    number of segments for cylinders with these radii
+    """
+    return np.clip(
+        np.round(per_radius * np.asarray(radii)), MIN_CYLINDER_SEGMENTS, MAX_CYLINDER_SEGMENTS
+    ).astype(int)
+
+
+def merge_meshes(meshes):
+    """
+    combine meshes into one mesh
+    meshes - list of (vertices, polygon vertex indices, normals)
+    vertices can be n_instances x n_vertices x 3 and normals
+    n_instances x n_polygon_vertices x 3 for copies of the same mesh
+    """
+    all_vertices = []
+    all_polygon_vertices = []
+    all_normals = []
+    offset = 0
+    for vertices, polygon_vertices, normals in meshes:
+        if vertices.ndim == 2:
+            vertices = vertices[np.newaxis]
+            normals = normals[np.newaxis]
+        n_instances, n_vertices = vertices.shape[:2]
+        offsets = offset + n_vertices * np.arange(n_instances)[:, np.newaxis]
+        # the last index of each polygon is stored as -index - 1
+        all_polygon_vertices.append(np.where(
+            polygon_vertices < 0, polygon_vertices - offsets, polygon_vertices + offsets
+        ).ravel())
+        all_vertices.append(vertices.reshape(-1, 3))
+        all_normals.append(normals.reshape(-1, 3))
+        offset += n_instances * n_vertices
+    return (
+        np.concatenate(all_vertices),
+        np.concatenate(all_polygon_vertices),
+        np.concatenate(all_normals),
+    )
+
+
+def cylinder_transforms(coords1, coords2):
+    """
+    returns the translation, rotation (XYZ Euler angles in degrees), and
+    scaling that put a cylinder from cylinder() between coords1 and coords2
+    coords1, coords2 - n_frames x n_cylinders x 3 arrays in ChimeraX's axes
+    the results are in FBX's axes, and the rotations are unwrapped
+    over the frames so interpolating between keys doesn't spin the cylinders
+    """
+    start = FBXScene.y_up(coords1)
+    end = FBXScene.y_up(coords2)
+    axis = end - start
+    length = np.linalg.norm(axis, axis=-1)
+    axis /= np.maximum(length, 1e-8)[..., np.newaxis]
+    # rotating Y about X and then about Z gives
+    # (-cos(x) sin(z), cos(x) cos(z), sin(x))
+    x_angle = np.arcsin(np.clip(axis[..., 2], -1, 1))
+    z_angle = np.unwrap(np.arctan2(-axis[..., 0], axis[..., 1]), axis=0)
+    rotation = np.degrees(np.stack([x_angle, np.zeros_like(x_angle), z_angle], axis=-1))
+    scaling = np.stack([np.ones_like(length), length, np.ones_like(length)], axis=-1)
+    return (start + end) / 2, rotation, scaling
+
+
+class FBXScene:
+    """
+    builds the nodes of an FBX document with meshes, materials, and models
+    coordinates are in ChimeraX's axes and are converted to FBX's Y up axes
+    one unit is written as one meter, like Blender's FBX exporter does
+    frame_rate - frames per second of animations
+    """
+    def __init__(self, creator="ORA stuff", frame_rate=24.):
+        self.creator = creator
+        self.frame_rate = frame_rate
+        self.objects = FBXNode("Objects")
+        self.connections = FBXNode("Connections")
+        self._next_id = 1000000
+        self.counts = dict()
+        self.n_frames = 1
+        self._animation_layer = None
+        # number of triangles in the models' meshes
+        self.n_triangles = 0
+        self._geometry_triangles = dict()
+
+    def new_id(self):
+        self._next_id += 1
+        return np.int64(self._next_id)
+
+    def _count(self, object_type):
+        self.counts[object_type] = self.counts.get(object_type, 0) + 1
+
+    def connect(self, child_id, parent_id, property_name=None):
+        if property_name is None:
+            self.connections.add("C", "OO", np.int64(child_id), np.int64(parent_id))
+        else:
+            self.connections.add("C", "OP", np.int64(child_id), np.int64(parent_id), property_name)
+
+    @staticmethod
+    def y_up(coords):
+        """
+        convert ChimeraX coordinates to FBX's Y up axes
+        """
+        coords = np.asarray(coords)
+        return np.stack([coords[..., 0], coords[..., 2], -coords[..., 1]], axis=-1)
+
+    def add_mesh(self, name, vertices, polygon_vertices, normals):
+        """
+        add a mesh geometry and return its id
+        vertices - coordinates in ChimeraX's axes
+        polygon_vertices - vertex indices in FBX's format
+        normals - normal of each polygon vertex, in ChimeraX's axes
+        """
+        geometry_id = self.new_id()
+        geometry = self.objects.add("Geometry", geometry_id, _name_class(name, "Geometry"), "Mesh")
+        geometry.children.append(_properties70())
+        geometry.add("GeometryVersion", 124)
+        geometry.add("Vertices", self.y_up(vertices).ravel())
+        geometry.add("PolygonVertexIndex", np.asarray(polygon_vertices, dtype=np.int32))
+        layer_normals = geometry.add("LayerElementNormal", 0)
+        layer_normals.add("Version", 102)
+        layer_normals.add("Name", "")
+        layer_normals.add("MappingInformationType", "ByPolygonVertex")
+        layer_normals.add("ReferenceInformationType", "Direct")
+        layer_normals.add("Normals", self.y_up(normals).ravel())
+        layer_material = geometry.add("LayerElementMaterial", 0)
+        layer_material.add("Version", 101)
+        layer_material.add("Name", "")
+        layer_material.add("MappingInformationType", "AllSame")
+        layer_material.add("ReferenceInformationType", "IndexToDirect")
+        layer_material.add("Materials", np.zeros(1, dtype=np.int32))
+        layer = geometry.add("Layer", 0)
+        layer.add("Version", 100)
+        for element_type in ["LayerElementNormal", "LayerElementMaterial"]:
+            element = layer.add("LayerElement")
+            element.add("Type", element_type)
+            element.add("TypedIndex", 0)
+        self._count("Geometry")
+        polygon_vertices = np.asarray(polygon_vertices)
+        self._geometry_triangles[geometry_id] = (
+            len(polygon_vertices) - 2 * np.count_nonzero(polygon_vertices < 0)
+        )
+        return geometry_id
+
+    def add_material(self, name, color):
+        """
+        add a material and return its id
+        color - linear RGBA from 0 to 1
+        """
+        material_id = self.new_id()
+        material = self.objects.add("Material", material_id, _name_class(name, "Material"), "")
+        material.add("Version", 102)
+        material.add("ShadingModel", "lambert")
+        material.add("MultiLayer", 0)
+        material.children.append(_properties70(
+            ("DiffuseColor", "Color", "", "A", *[float(c) for c in color[:3]]),
+            ("DiffuseFactor", "Number", "", "A", 1.0),
+            ("Opacity", "Number", "", "A", float(color[3])),
+            ("TransparencyFactor", "Number", "", "A", 1. - float(color[3])),
+        ))
+        self._count("Material")
+        return material_id
+
+    def add_model(
+        self,
+        name,
+        translation,
+        rotation=None,
+        scaling=None,
+        geometry_id=None,
+        material_ids=(),
+        parent_id=0,
+    ):
+        """
+        add a model (i.e. an object in Blender) and return its id
+        translation - position in ChimeraX's axes
+        rotation - XYZ Euler angles in degrees in FBX's axes
+        scaling - scale factors in FBX's axes
+        """
+        properties = [
+            ("Lcl Translation", "Lcl Translation", "", "A", *self.y_up(translation).tolist()),
+        ]
+        if rotation is not None:
+            properties.append(("Lcl Rotation", "Lcl Rotation", "", "A", *[float(x) for x in rotation]))
+        if scaling is not None:
+            properties.append(("Lcl Scaling", "Lcl Scaling", "", "A", *[float(x) for x in scaling]))
+        properties.append(("DefaultAttributeIndex", "int", "Integer", "", 0))
+        model_id = self.new_id()
+        model = self.objects.add(
+            "Model", model_id, _name_class(name, "Model"),
+            "Mesh" if geometry_id is not None else "Null",
+        )
+        model.add("Version", 232)
+        model.children.append(_properties70(*properties))
+        model.add("Shading", True)
+        model.add("Culling", "CullingOff")
+        self.connect(model_id, parent_id)
+        if geometry_id is not None:
+            self.connect(geometry_id, model_id)
+            self.n_triangles += self._geometry_triangles[geometry_id]
+        for material_id in material_ids:
+            self.connect(material_id, model_id)
+        self._count("Model")
+        return model_id
+
+    def animation_layer(self, n_frames):
+        """
+        returns the id of the animation layer, which is added the first time
+        all animated properties must have the same number of frames
+        """
+        if self._animation_layer is not None:
+            if n_frames != self.n_frames:
+                raise RuntimeError(
+                    "animation has %i frames, but %i were given" % (self.n_frames, n_frames)
+                )
+            return self._animation_layer
+        self.n_frames = n_frames
+        stop = self.key_times(n_frames)[-1]
+        stack_id = self.new_id()
+        stack = self.objects.add("AnimationStack", stack_id, _name_class("Take 001", "AnimStack"), "")
+        stack.children.append(_properties70(
+            ("LocalStart", "KTime", "Time", "", np.int64(0)),
+            ("LocalStop", "KTime", "Time", "", stop),
+            ("ReferenceStart", "KTime", "Time", "", np.int64(0)),
+            ("ReferenceStop", "KTime", "Time", "", stop),
+        ))
+        self._count("AnimationStack")
+        self._animation_layer = self.new_id()
+        self.objects.add("AnimationLayer", self._animation_layer, _name_class("BaseLayer", "AnimLayer"), "")
+        self._count("AnimationLayer")
+        self.connect(self._animation_layer, stack_id)
+        return self._animation_layer
+
+    def key_times(self, n_frames):
+        """
+        FBX time of each frame
+        """
+        return np.round(
+            np.arange(n_frames) * (FBX_TICKS_PER_SECOND / self.frame_rate)
+        ).astype(np.int64)
+
+    def animate(self, object_ids, property_name, values, channels=("X", "Y", "Z"), constant=False):
+        """
+        add a key on every frame for a property of each object
+        object_ids - ids of the animated objects
+        property_name - name of the property (e.g. "Lcl Translation")
+        values - n_frames x n_objects x len(channels) array of values
+        constant - values are held until the next key instead of interpolated
+        """
+        values = np.asarray(values, dtype=np.float32)
+        layer_id = self.animation_layer(len(values))
+        times = self.key_times(len(values))
+        flags = np.array([
+            _INTERPOLATION_CONSTANT if constant else _INTERPOLATION_LINEAR
+        ], dtype=np.int32)
+        attr_data = np.zeros(4, dtype=np.float32)
+        ref_count = np.array([len(times)], dtype=np.int32)
+        node_name = _curve_node_names.get(property_name, property_name)
+        # one column of keys for each curve
+        curves = values.reshape(len(values), -1).T.copy()
+        for i, object_id in enumerate(object_ids):
+            node_id = self.new_id()
+            node = self.objects.add(
+                "AnimationCurveNode", node_id, _name_class(node_name, "AnimCurveNode"), ""
+            )
+            node.children.append(_properties70(*[
+                ("d|%s" % channel, "Number", "", "A", float(values[0, i, j]))
+                for j, channel in enumerate(channels)
+            ]))
+            self._count("AnimationCurveNode")
+            self.connect(node_id, layer_id)
+            self.connect(node_id, object_id, property_name)
+            for j, channel in enumerate(channels):
+                curve_id = self.new_id()
+                curve = self.objects.add("AnimationCurve", curve_id, _name_class("", "AnimCurve"), "")
+                curve.add("Default", float(values[0, i, j]))
+                curve.add("KeyVer", 4009)
+                curve.add("KeyTime", times)
+                curve.add("KeyValueFloat", curves[i * len(channels) + j])
+                curve.add("KeyAttrFlags", flags)
+                curve.add("KeyAttrDataFloat", attr_data)
+                curve.add("KeyAttrRefCount", ref_count)
+                self._count("AnimationCurve")
+                self.connect(curve_id, node_id, "d|%s" % channel)
+
+    def nodes(self):
+        """
+        returns the top level nodes of the document
+        """
+        header = FBXNode("FBXHeaderExtension")
+        header.add("FBXHeaderVersion", 1003)
+        header.add("FBXVersion", FBX_VERSION)
+        header.add("EncryptionType", 0)
+        timestamp = header.add("CreationTimeStamp")
+        for name, value in [
+            ("Version", 1000),
+            ("Year", 1970),
+            ("Month", 1),
+            ("Day", 1),
+            ("Hour", 10),
+            ("Minute", 0),
+            ("Second", 0),
+            ("Millisecond", 0),
+        ]:
+            timestamp.add(name, value)
+        header.add("Creator", self.creator)
+
+        global_settings = FBXNode("GlobalSettings")
+        global_settings.add("Version", 1000)
+        global_settings.children.append(_properties70(
+            ("UpAxis", "int", "Integer", "", 1),
+            ("UpAxisSign", "int", "Integer", "", 1),
+            ("FrontAxis", "int", "Integer", "", 2),
+            ("FrontAxisSign", "int", "Integer", "", 1),
+            ("CoordAxis", "int", "Integer", "", 0),
+            ("CoordAxisSign", "int", "Integer", "", 1),
+            ("OriginalUpAxis", "int", "Integer", "", -1),
+            ("OriginalUpAxisSign", "int", "Integer", "", 1),
+            ("UnitScaleFactor", "double", "Number", "", 100.0),
+            ("OriginalUnitScaleFactor", "double", "Number", "", 100.0),
+            ("AmbientColor", "ColorRGB", "Color", "", 0.0, 0.0, 0.0),
+            ("DefaultCamera", "KString", "", "", "Producer Perspective"),
+            # custom frame rate
+            ("TimeMode", "enum", "", "", 14),
+            ("TimeSpanStart", "KTime", "Time", "", np.int64(0)),
+            ("TimeSpanStop", "KTime", "Time", "", self.key_times(self.n_frames)[-1]),
+            ("CustomFrameRate", "double", "Number", "", float(self.frame_rate)),
+        ))
+
+        documents = FBXNode("Documents")
+        documents.add("Count", 1)
+        document = documents.add("Document", self.new_id(), "Scene", "Scene")
+        document.children.append(_properties70(
+            ("SourceObject", "object", "", ""),
+            ("ActiveAnimStackName", "KString", "", "", "Take 001" if self._animation_layer is not None else ""),
+        ))
+        document.add("RootNode", np.int64(0))
+
+        definitions = FBXNode("Definitions")
+        definitions.add("Version", 100)
+        definitions.add("Count", 1 + sum(self.counts.values()))
+        definitions.add("ObjectType", "GlobalSettings").add("Count", 1)
+        for object_type, count in self.counts.items():
+            definitions.add("ObjectType", object_type).add("Count", count)
+
+        return [
+            header,
+            FBXNode("FileId", _FILE_ID),
+            FBXNode("CreationTime", _CREATION_TIME),
+            FBXNode("Creator", self.creator),
+            global_settings,
+            documents,
+            FBXNode("References"),
+            definitions,
+            self.objects,
+            self.connections,
+        ]
+
+    def write(self, path):
+        write_fbx(path, self.nodes())
+
+
+def linear_colors(colors, y_cor=2.2):
+    """
+    convert ChimeraX's 0-255 RGBA colors to linear 0-1 colors
+    """
+    colors = np.asarray(colors) / 255.
+    colors[..., :3] **= y_cor
+    return colors
+
+
+def atom_labels(model):
+    """
+    the label of each atom is the element + atom number (zero padded)
+    """
+    pad = 1 + int(max(0, np.log10(model.num_atoms)))
+    label_format = "%%s%%0%ii" % pad
+    return [
+        label_format % (ele, i + 1) for i, ele in enumerate(model.atoms.elements.names)
+    ]
+
+
+def atom_spheres(scene, model, coords, segments=32, rings=16, y_cor=2.2, merge=False):
+    """
+    add a sphere for each atom of model to scene
+    atoms with the same element and resolution share a mesh, and each
+    element has a material with the color of the first atom of that element
+    coords - n_frames x n_atoms x 3 array of coordinates, the spheres
+             are animated if there is more than one frame
+    segments, rings - resolution of all spheres or each atom's sphere
+    merge - combine the spheres of each element into one mesh
+            (only for one frame)
+    returns the model id of each atom
+    """
+    if merge and len(coords) > 1:
+        raise RuntimeError("merged spheres cannot be animated")
+    atoms = model.atoms
+    elements = atoms.elements.names
+    radii = atoms.display_radii
+    colors = linear_colors(atoms.colors, y_cor)
+    segments = np.broadcast_to(segments, len(radii))
+    rings = np.broadcast_to(rings, len(radii))
+
+    spheres = dict()
+    materials = dict()
+    meshes = dict()
+    for i, (ele, radius, atom_segments, atom_rings) in enumerate(
+        zip(elements, radii, segments, rings)
+    ):
+        ele = str(ele)
+        if ele not in materials:
+            materials[ele] = scene.add_material(ele, colors[i])
+        if (atom_segments, atom_rings) not in spheres:
+            spheres[(atom_segments, atom_rings)] = uv_sphere(atom_segments, atom_rings)
+        key = (ele, float(radius), atom_segments, atom_rings)
+        meshes.setdefault(key, []).append(i)
+
+    if merge:
+        merged = dict()
+        for (ele, radius, atom_segments, atom_rings), ndx in meshes.items():
+            sphere_vertices, polygon_vertices, normals = spheres[(atom_segments, atom_rings)]
+            merged.setdefault(ele, []).append((
+                radius * sphere_vertices + coords[0, ndx, np.newaxis],
+                polygon_vertices,
+                np.broadcast_to(normals, (len(ndx), *normals.shape)),
+            ))
+        element_ids = {
+            ele: scene.add_model(
+                ele,
+                [0, 0, 0],
+                geometry_id=scene.add_mesh(ele, *merge_meshes(element_meshes)),
+                material_ids=[materials[ele]],
+            ) for ele, element_meshes in merged.items()
+        }
+        return [element_ids[str(ele)] for ele in elements]
+
+    labels = atom_labels(model)
+    atom_ids = np.zeros(len(radii), dtype=np.int64)
+    for key, ndx in meshes.items():
+        ele, radius, atom_segments, atom_rings = key
+        sphere_vertices, polygon_vertices, normals = spheres[(atom_segments, atom_rings)]
+        geometry_id = scene.add_mesh(
+            "%s_%f_%i" % (ele, radius, atom_segments),
+            radius * sphere_vertices,
+            polygon_vertices,
+            normals,
+        )
+        for i in ndx:
+            atom_ids[i] = scene.add_model(
+                labels[i],
+                coords[0, i],
+                geometry_id=geometry_id,
+                material_ids=[materials[ele]],
+            )
+    atom_ids = [np.int64(atom_id) for atom_id in atom_ids]
+    if len(coords) > 1:
+        scene.animate(atom_ids, "Lcl Translation", scene.y_up(coords))
+    return atom_ids
+
+
+def _place_cylinders(vertices, normals, coords1, coords2, radius):
+    """
+    returns the vertices and normals of cylinders from cylinder()
+    between each of coords1 and coords2, all in ChimeraX's axes
+    """
+    axis = coords2 - coords1
+    unit = axis / np.maximum(np.linalg.norm(axis, axis=-1), 1e-8)[:, np.newaxis]
+    # any vector that isn't parallel to the axis gives a perpendicular one
+    other = np.where(np.abs(unit[:, :1]) < 0.9, [1., 0., 0.], [0., 1., 0.])
+    side1 = np.cross(unit, other)
+    side1 /= np.linalg.norm(side1, axis=-1)[:, np.newaxis]
+    side2 = np.cross(unit, side1)
+    basis = np.stack([radius * side1, radius * side2, axis], axis=-1)
+    normal_basis = np.stack([side1, side2, np.zeros_like(side1)], axis=-1)
+    return (
+        np.einsum("kij,vj->kvi", basis, vertices) + ((coords1 + coords2) / 2)[:, np.newaxis],
+        np.einsum("kij,vj->kvi", normal_basis, normals),
+    )
+
+
+def add_cylinders(
+    scene,
+    names,
+    coords1,
+    coords2,
+    radii,
+    material_id,
+    visible=None,
+    segments=16,
+    merged_name=None,
+):
+    """
+    add a cylinder between each pair of points to scene
+    cylinders with the same radius and resolution share a mesh
+    names - name of each cylinder
+    coords1, coords2 - n_frames x n_cylinders x 3 arrays of the ends of
+                       the cylinders, the cylinders are animated if
+                       there is more than one frame
+    radii - radius of each cylinder
+    material_id - material of the cylinders
+    visible - n_frames x n_cylinders array, cylinders are hidden in
+              frames where this is False
+    segments - resolution of all cylinders or each cylinder
+    merged_name - if given, the cylinders are combined into one mesh
+                  with this name (only for one frame)
+    returns the model id of each cylinder
+    """
+    segments = np.broadcast_to(segments, len(radii))
+    templates = {n: cylinder(n) for n in np.unique(segments)}
+    meshes = dict()
+    for i, (radius, cylinder_segments) in enumerate(zip(radii, segments)):
+        meshes.setdefault((float(radius), cylinder_segments), []).append(i)
+
+    if merged_name is not None:
+        if len(coords1) > 1:
+            raise RuntimeError("merged cylinders cannot be animated")
+        merged = []
+        for (radius, cylinder_segments), ndx in meshes.items():
+            if visible is not None:
+                ndx = [i for i in ndx if visible[0, i]]
+            vertices, polygon_vertices, normals = templates[cylinder_segments]
+            vertices, normals = _place_cylinders(
+                vertices, normals, coords1[0, ndx], coords2[0, ndx], radius
+            )
+            merged.append((vertices, polygon_vertices, normals))
+        model_id = scene.add_model(
+            merged_name,
+            [0, 0, 0],
+            geometry_id=scene.add_mesh(merged_name, *merge_meshes(merged)),
+            material_ids=[material_id],
+        )
+        return [model_id] * len(radii)
+
+    translation, rotation, scaling = cylinder_transforms(coords1, coords2)
+    if visible is not None:
+        # importers that don't read visibility keys still
+        # won't show the cylinder when it has no size
+        scaling *= visible[..., np.newaxis]
+    cylinder_ids = np.zeros(len(radii), dtype=np.int64)
+    for (radius, cylinder_segments), ndx in meshes.items():
+        vertices, polygon_vertices, normals = templates[cylinder_segments]
+        geometry_id = scene.add_mesh(
+            "cylinder_%f_%i" % (radius, cylinder_segments),
+            vertices * [radius, radius, 1],
+            polygon_vertices,
+            normals,
+        )
+        for i in ndx:
+            cylinder_ids[i] = scene.add_model(
+                names[i],
+                (coords1[0, i] + coords2[0, i]) / 2,
+                rotation=rotation[0, i],
+                scaling=scaling[0, i],
+                geometry_id=geometry_id,
+                material_ids=[material_id],
+            )
+    cylinder_ids = [np.int64(cylinder_id) for cylinder_id in cylinder_ids]
+    if len(translation) > 1:
+        scene.animate(cylinder_ids, "Lcl Translation", translation)
+        scene.animate(cylinder_ids, "Lcl Rotation", rotation)
+        scene.animate(cylinder_ids, "Lcl Scaling", scaling)
+        if visible is not None:
+            scene.animate(
+                cylinder_ids,
+                "Visibility",
+                visible[..., np.newaxis],
+                channels=("Visibility",),
+                constant=True,
+            )
+    return cylinder_ids
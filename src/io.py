@@ -1,29 +1,45 @@
+import bz2
+import gzip
+import hashlib
+import html
+import lzma
+import mmap
 import os
+import queue
+import shutil
 import subprocess
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from itertools import islice, repeat
+from multiprocessing import get_context
 
 from chimerax.atomic import AtomicStructure
+from chimerax.core.triggerset import DEREGISTER
 
 import numpy as np
 
 from AaronTools.const import ELEMENTS
 
-from ora_stuff.mouse_modes import (
-    SetHalfBond,
-    SetSingleBond,
-    SetAromaticBond,
-    SetPartialDoubleBond,
-    SetDoubleBond,
-    SetTripleBond,
+from ora_stuff.bond_orders import (
+    bond_order_code,
+    bond_order_code_names,
+    bond_order_styles,
+    bond_order_timeline,
+)
+from ora_stuff.fbx import (
+    FBXScene,
+    add_cylinders,
+    atom_labels,
+    atom_spheres,
+    cylinder_segments,
+    linear_colors,
+    segments_per_radius,
+    sphere_segments,
+    sphere_triangles,
 )
-
-bo_to_mol_map = {
-    0.5: 8,
-    1.0: 1,
-    "ar": 4,
-    1.5: 5,
-    2.0: 2,
-    3.0: 3,
-}
 
 mol_to_bo_map = {
     8: "half",
@@ -34,82 +50,822 @@ mol_to_bo_map = {
     3: "triple",
 }
 
-def open_sdf(session, stream, filename, **kw):
-    try:
-        all_coordsets = []
-        elements = []
-        all_bondsets = []
+# parsed SDF files are cached as .npy files in the user's cache directory
+# files smaller than SDF_CACHE_MIN_FILE_SIZE bytes are fast enough to parse
+# least recently used entries are removed when the total is
+# more than SDF_CACHE_SIZE bytes
+SDF_CACHE_VERSION = 1
+SDF_CACHE_MIN_FILE_SIZE = 1 << 20
+SDF_CACHE_SIZE = 2 << 30
+
+# approximate number of characters save_sdf formats at a time
+SDF_WRITE_BUFFER_SIZE = 1 << 22
+
+# radius of bond order cylinders in FBX files when the
+# bond order's pseudobonds aren't shown
+FBX_BOND_ORDER_RADIUS = 0.06
+# default number of triangles in FBX files when the resolution isn't given
+# small structures get full resolution spheres, and larger ones are
+# reduced to something a mobile headset can draw at frame rate
+FBX_TRIANGLE_BUDGET = 300000
+
+# _BlenderJob instances for FBX files, the first one
+# is running and the others are waiting for it
+blender_jobs = []
+# printed by blender after each script of a job
+_BLENDER_EXPORT_MARKER = "ora_stuff export finished:"
+
+
+def _compression_module(path):
+    """
+    returns the module for compressed files with path's suffix
+    or None if path isn't compressed
+    """
+    return {
+        ".gz": gzip,
+        ".bz2": bz2,
+        ".xz": lzma,
+    }.get(os.path.splitext(path)[1].lower())
+
+
+def _open_text(path, mode="r", compression_level=None):
+    """
+    open a text file that is read or written as a stream
+    the file is compressed if path ends with .gz, .bz2, or .xz
+    """
+    module = _compression_module(path)
+    if module is None:
+        return open(path, mode)
+    kw = {}
+    if compression_level is not None and module is lzma:
+        kw["preset"] = compression_level
+    elif compression_level is not None:
+        kw["compresslevel"] = compression_level
+    return module.open(path, mode + "t", encoding="utf-8", **kw)
+
+
+def _fixed_width_columns(lines, width, start, stop, field_width):
+    """
+    slice the same fixed-width columns out of each line and return them
+    as an (n_lines, n_fields, field_width) array of ASCII codes
+    lines that are shorter than width are padded with null bytes
+    """
+    n_fields = (stop - start) // field_width
+    if not lines:
+        # e.g. the bond blocks of records without bonds
+        return np.zeros((0, n_fields, field_width), dtype=np.uint8)
+    block = np.array(lines, dtype="S%i" % width)
+    chars = block.view(np.uint8).reshape(len(lines), width)
+    return chars[:, start:stop].reshape(len(lines), n_fields, field_width)
+
+
+def _parse_fixed_width(chars, as_int=False):
+    """
+    convert an array of ASCII codes for fixed-width decimal numbers
+    (last axis is the characters of each field) to numbers
+    the result is identical to calling float() on each field because
+    the digits are accumulated as an integer and divided once
+    """
+    digits = chars - 48
+    is_digit = digits < 10
+    digits = np.where(is_digit, digits, 0).astype(np.int64)
+    negative = (chars == 45).any(axis=-1)
+    width = chars.shape[-1]
+    is_point = chars == 46
+    point = np.argmax(is_point.reshape(-1, width)[0]) if chars.size else 0
+    if not as_int and is_point[..., point].all() and is_digit[..., point + 1:].all():
+        # usual case - every field has the decimal point in the same column
+        # and is right-justified, so every column has the same place value
+        place = 10 ** np.concatenate([
+            np.arange(width - 2, width - point - 2, -1),
+            [0],
+            np.arange(width - point - 2, -1, -1),
+        ]).astype(np.int64)
+        value = (digits @ place) / 10.0 ** (width - point - 1)
+        return np.where(negative, -value, value)
+
+    # place value of each digit, ignoring the decimal point
+    place = np.cumsum(is_digit[..., ::-1], axis=-1)[..., ::-1] - 1
+    mantissa = (digits * 10 ** np.maximum(place, 0).astype(np.int64)).sum(axis=-1)
+    if as_int:
+        return np.where(negative, -mantissa, mantissa)
+    # number of digits after the decimal point
+    after_point = is_digit & (np.cumsum(is_point, axis=-1) > 0)
+    value = mantissa / 10.0 ** after_point.sum(axis=-1)
+    return np.where(negative, -value, value)
+
+
+def _decode_v2000_atoms(lines):
+    """
+    decode the lines of V2000 atom blocks into an n_lines x 3
+    array of coordinates
+    """
+    # read according to the MDL Informatics Systems prescription
+    # from 2003
+    # columns 1-10 define x position, and there should be
+    # 4 digits after the decimal
+    # columns 11-20 are for the y position
+    # columns 21-30 are for the z position
+    # column 31 is empty
+    # columns 32-34 are for the element symbol
+    return _parse_fixed_width(_fixed_width_columns(lines, 34, 0, 30, 10))
+
+
+def _decode_v2000_elements(lines):
+    """
+    decode the element symbols (or atomic numbers) of a V2000 atom block
+    """
+    elements = _fixed_width_columns(lines, 34, 31, 34, 3)
+    return [
+        ele.strip(b" \x00").decode("ascii")
+        for ele in elements.reshape(-1, 3).view("S3").reshape(-1).tolist()
+    ]
+
+
+def _decode_v2000_bonds(lines, n_bonds):
+    """
+    decode the lines of V2000 bond blocks into arrays of
+    (atom 1 index, atom 2 index, bond order)
+    n_bonds is the number of bonds in each record
+    returns an n_bonds x 3 array for each record
+    atom indices are 0-indexed
+    """
+    # columns 1-3 and 4-6 are the atom numbers
+    # columns 7-9 are the bond type
+    bonds = _parse_fixed_width(_fixed_width_columns(lines, 9, 0, 9, 3), as_int=True)
+    bonds = bonds.reshape(-1, 3)
+    bonds[:, :2] -= 1
+    return np.split(bonds, np.cumsum(n_bonds)[:-1])
+
+
+def _read_v3000_record(stream, line, read_elements=False):
+    """
+    read the CTAB of a V3000 record
+    returns coordinates, elements (if read_elements), and bonds
+    """
+    n_atoms = 0
+    n_bonds = 0
+    coords = np.zeros((0, 3))
+    bonds = np.zeros((0, 3), dtype=int)
+    elements = [] if read_elements else None
+    while "M END" not in line and line.strip():
         line = stream.readline()
-        n_atoms = 0
-        n_bonds = 0
-        while line:
-            if "v2000" in line.lower():
-                # read according to the MDL Informatics Systems prescription
-                # from 2003
-                this_coordset = []
-                this_bondset = []
-                n_atoms = int(line[:3])
-                n_bonds = int(line[3:6])
-                for i in range(0, n_atoms):
-                    # columns 1-10 define x position, and there should be
-                    # 4 digits after the decimal
-                    # columns 11-20 are for the y position
-                    # columns 21-30 are for the z position
-                    # column 31 is empty
-                    # columns 32-34 are for the element symbol
-                    line = stream.readline()
-                    coords = [float(line[0:11]), float(line[11:21]), float(line[21:31])]
-                    this_coordset.append(coords)
-                    if all_coordsets:
-                        continue
-                    ele = line[31:34].strip()
-                    elements.append(ele)
-                
-                for i in range(0, n_bonds):
-                    line = stream.readline()
-                    a1 = int(line[:3])
-                    a2 = int(line[3:6])
-                    order = int(line[6:9])
-                    this_bondset.append([a1 - 1, a2 - 1, order])
-                
-                all_coordsets.append(this_coordset)
-                all_bondsets.append(this_bondset)
-            
-            elif "v3000" in line.lower():
-                this_coordset = []
-                this_bondset = []
-                while "M END" not in line and line.strip():
-                    line = stream.readline()
-                    if "COUNTS" in line:
-                        n_atoms = int(line.split()[3])
-                        n_bonds = int(line.split()[4])
-
-                    if "BEGIN ATOM" in line:
-                        for i in range(0, n_atoms):
-                            line = stream.readline()
-                            x, y, z = [float(x) for x in line.split()[4:7]]
-                            this_coordset.append([x, y, z])
-                            if all_coordsets:
-                                continue
-                            ele = line.split()[3].strip()
-                            elements.append(ele)
-                    
-                    if "BEGIN BOND" in line:
-                        for i in range(0, n_bonds):
-                            line = stream.readline()
-                            info = line.split()
-                            a1 = int(info[4])
-                            a2 = int(info[5])
-                            order = int(info[3])
-                            this_bondset.append([a1 - 1, a2 - 1, order])
-                
-                all_coordsets.append(this_coordset)
-                all_bondsets.append(this_bondset)
-            
-            else:
+        if "COUNTS" in line:
+            n_atoms = int(line.split()[3])
+            n_bonds = int(line.split()[4])
+
+        if "BEGIN ATOM" in line:
+            coords = np.zeros((n_atoms, 3))
+            for i in range(0, n_atoms):
+                info = stream.readline().split()
+                coords[i] = info[4:7]
+                if read_elements:
+                    elements.append(info[3].strip())
+
+        if "BEGIN BOND" in line:
+            bonds = np.zeros((n_bonds, 3), dtype=int)
+            for i in range(0, n_bonds):
+                info = stream.readline().split()
+                bonds[i] = [int(info[4]) - 1, int(info[5]) - 1, int(info[3])]
+
+    return coords, elements, bonds
+
+
+def _skip_record(stream, line):
+    """
+    advance the stream past the CTAB of a record without decoding it
+    line is the counts line of the record
+    """
+    if "v2000" in line.lower():
+        for line in islice(stream, int(line[:3]) + int(line[3:6])):
+            pass
+        return
+    while "M END" not in line and line.strip():
+        line = stream.readline()
+
+
+def _read_sdf(stream, first=1, last=None, stride=1, batch_size=100000):
+    """
+    read records in an SDF stream
+    first - number of the first record to read (starting from 1)
+    last - number of the last record to read
+    stride - read every stride-th record after first
+    returns a list of element symbols (or atomic numbers), an
+    n_frames x n_atoms x 3 array of coordinates, and a list with an
+    n_bonds x 3 array of bonds for each frame
+    V2000 atom and bond blocks are decoded together once batch_size
+    lines have been read
+    """
+    if first < 1 or stride < 1:
+        raise RuntimeError("first and stride must be positive integers")
+    elements = None
+    all_coordsets = None
+    all_bondsets = []
+    n_frames = 0
+    n_records = 0
+    # V2000 lines that have been read but not decoded
+    batch_start = 0
+    atom_lines = []
+    bond_lines = []
+    n_bonds = []
+
+    def decode_batch():
+        if not n_bonds:
+            return
+        all_coordsets[batch_start:n_frames] = _decode_v2000_atoms(
+            atom_lines
+        ).reshape(n_frames - batch_start, -1, 3)
+        all_bondsets.extend(_decode_v2000_bonds(bond_lines, n_bonds))
+        atom_lines.clear()
+        bond_lines.clear()
+        n_bonds.clear()
+
+    line = stream.readline()
+    while line:
+        header = line.lower()
+        if "v2000" in header or "v3000" in header:
+            n_records += 1
+            if last is not None and n_records > last:
+                break
+            if n_records < first or (n_records - first) % stride:
+                _skip_record(stream, line)
                 line = stream.readline()
+                continue
+
+        if "v2000" in header:
+            n_atoms = int(line[:3])
+            n_bonds.append(int(line[3:6]))
+            atom_lines.extend(islice(stream, n_atoms))
+            bond_lines.extend(islice(stream, n_bonds[-1]))
+            if elements is None:
+                elements = _decode_v2000_elements(atom_lines)
+                all_coordsets = np.zeros((16, n_atoms, 3))
+            all_coordsets = _check_frame(all_coordsets, n_frames, n_atoms)
+            n_frames += 1
+            if len(atom_lines) + len(bond_lines) >= batch_size:
+                decode_batch()
+                batch_start = n_frames
+
+        elif "v3000" in header:
+            decode_batch()
+            coords, frame_elements, bonds = _read_v3000_record(
+                stream, line, read_elements=elements is None,
+            )
+            if elements is None:
+                elements = frame_elements
+                all_coordsets = np.zeros((16, len(coords), 3))
+            all_coordsets = _check_frame(all_coordsets, n_frames, len(coords))
+            all_coordsets[n_frames] = coords
+            all_bondsets.append(bonds)
+            n_frames += 1
+            batch_start = n_frames
+
+        line = stream.readline()
+
+    decode_batch()
+
+    if all_coordsets is None:
+        raise RuntimeError("no V2000 or V3000 records found")
+
+    return elements, all_coordsets[:n_frames], all_bondsets
+
+
+def _check_frame(all_coordsets, n_frames, n_atoms):
+    """
+    make sure there is room in all_coordsets for another frame
+    with n_atoms atoms
+    the buffer's capacity is doubled when it is full
+    """
+    if n_atoms != all_coordsets.shape[1]:
+        raise RuntimeError(
+            "record %i has %i atoms, expected %i" % (
+                n_frames + 1, n_atoms, all_coordsets.shape[1]
+            )
+        )
+    if n_frames < len(all_coordsets):
+        return all_coordsets
+    grown = np.zeros((2 * len(all_coordsets), *all_coordsets.shape[1:]))
+    grown[:n_frames] = all_coordsets
+    return grown
+
+
+def _index_sdf(buf):
+    """
+    find the byte offsets of each record in an SDF file
+    buf should be a bytes-like object (e.g. an mmap of the file)
+    returns a list of (start, stop) offsets
+    """
+    records = []
+    start = 0
+    end = buf.find(b"$$$$")
+    while end != -1:
+        stop = buf.find(b"\n", end)
+        stop = len(buf) if stop == -1 else stop + 1
+        records.append((start, stop))
+        start = stop
+        end = buf.find(b"$$$$", start)
+    # the last record might not have a $$$$ line
+    if buf[start:].strip():
+        records.append((start, len(buf)))
+    return records
+
+
+def _read_sdf_records(path, records):
+    """
+    read the (start, stop) byte ranges of an SDF file
+    this is run in worker processes by _read_sdf_parallel
+    returns elements, coordinates, all bonds, and the number of
+    bonds in each frame
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            text = b"".join(buf[start:stop] for start, stop in records)
+    elements, coords, bonds = _read_sdf(StringIO(text.decode("utf-8")))
+    return elements, coords, np.concatenate(bonds), [len(b) for b in bonds]
+
+
+def _read_sdf_parallel(path, processes, first=1, last=None, stride=1):
+    """
+    read records of an SDF file using a pool of processes
+    the file is split at $$$$ lines, and each process reads a block
+    of consecutive records
+    returns the same thing as _read_sdf
+    """
+    if first < 1 or stride < 1:
+        raise RuntimeError("first and stride must be positive integers")
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            records = _index_sdf(buf)[first - 1:last:stride]
+    if not records:
+        raise RuntimeError("no V2000 or V3000 records found")
+    
+    # a few blocks per process so one slow block doesn't hold up the rest
+    n_blocks = min(len(records), 4 * processes)
+    blocks = [
+        records[i * len(records) // n_blocks:(i + 1) * len(records) // n_blocks]
+        for i in range(0, n_blocks)
+    ]
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=get_context("spawn")
+    ) as pool:
+        results = list(pool.map(_read_sdf_records, repeat(path), blocks))
+    
+    elements = results[0][0]
+    n_atoms = len(elements)
+    all_coordsets = np.empty((sum(len(r[1]) for r in results), n_atoms, 3))
+    all_bondsets = []
+    n_frames = 0
+    for _, coords, bonds, n_bonds in results:
+        if coords.shape[1] != n_atoms:
+            raise RuntimeError(
+                "record %i has %i atoms, expected %i" % (
+                    n_frames + 1, coords.shape[1], n_atoms
+                )
+            )
+        all_coordsets[n_frames:n_frames + len(coords)] = coords
+        all_bondsets.extend(np.split(bonds, np.cumsum(n_bonds)[:-1]))
+        n_frames += len(coords)
+    
+    return elements, all_coordsets, all_bondsets
+
+
+class _LazySDFFrames:
+    """
+    byte offsets of the records in an SDF file, which are only
+    decoded when needed
+    decoded frames are kept in a bounded LRU cache
+    """
+    def __init__(self, path, cache_size=64, first=1, last=None, stride=1):
+        if first < 1 or stride < 1:
+            raise RuntimeError("first and stride must be positive integers")
+        with open(path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.records = _index_sdf(self._buf)[first - 1:last:stride]
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.records)
+
+    def frame(self, ndx):
+        """
+        returns elements, coordinates, and bonds for the frame
+        """
+        try:
+            self._cache.move_to_end(ndx)
+            return self._cache[ndx]
+        except KeyError:
+            pass
+        start, stop = self.records[ndx]
+        elements, coords, bonds = _read_sdf(
+            StringIO(self._buf[start:stop].decode("utf-8"))
+        )
+        self._cache[ndx] = (elements, coords[0], bonds[0])
+        while len(self._cache) > max(self.cache_size, 1):
+            self._cache.popitem(last=False)
+        return self._cache[ndx]
+
+    def close(self):
+        self._cache.clear()
+        self._buf.close()
+
+
+class _PendingFrames:
+    """
+    frames from an SDF file that have not been added to the
+    structure's coordinate sets yet
+    until a frame is read, its coordinate set is a copy of the first frame
+    """
+    def __init__(self, session, structure, lazy_frames=None):
+        self.session = session
+        self.structure = structure
+        # _LazySDFFrames the coordinates are read from
+        self.lazy_frames = lazy_frames
+        # coordset id -> frame index for frames that have not been read
+        self.coords = dict()
+        # (pair id, bond order code, start, stop) bond order edits
+        # that are applied to frames when they are read
+        self.edits = []
+        self._warned = set()
+        self._handlers = []
+
+    def watch(self):
+        """
+        read frames when they become the active coordinate set, read
+        all of them before a session is saved, and close the file
+        when the structure is deleted
+        """
+        structure = self.structure
+        self._handlers = [
+            (structure.triggers, structure.triggers.add_handler(
+                "changes", _pending_coordset_changed
+            )),
+            (structure.triggers, structure.triggers.add_handler(
+                "deleted", self._structure_deleted
+            )),
+            (self.session.triggers, self.session.triggers.add_handler(
+                "begin save session", self._begin_save_session
+            )),
+        ]
+
+    def _begin_save_session(self, trigger_name, session):
+        # sessions have every coordinate set, and the ones
+        # that haven't been read are copies of the first frame
+        load_coordsets(self.structure)
+
+    def _structure_deleted(self, trigger_name, structure):
+        self.close()
+
+    def close(self):
+        for triggers, handler in self._handlers:
+            triggers.remove_handler(handler)
+        self._handlers = []
+        if self.lazy_frames is not None:
+            self.lazy_frames.close()
+            self.lazy_frames = None
+
+
+def _known_bonds(session, bonds, warned=None):
+    """
+    remove bonds with orders that aren't in mol_to_bo_map
+    warned - set of orders that have already been reported
+    """
+    known = np.isin(bonds[:, 2], list(mol_to_bo_map.keys()))
+    if known.all():
+        return bonds
+    if warned is None:
+        warned = set()
+    for order in np.unique(bonds[~known, 2]).tolist():
+        if order not in warned:
+            session.logger.warning("unknown bond order %i" % order)
+            warned.add(order)
+    return bonds[known]
+
+
+def _set_bond_orders(struc, cs_ids, bondsets, max_codes=1 << 24):
+    """
+    put the bonds of each coordinate set in the structure's BondOrderTimeline
+    bondsets - (atom 1 index, atom 2 index, mol order) arrays with only
+               orders in mol_to_bo_map
+    max_codes - limit on the size of the frame x pair array of codes
+                that is made at once
+    """
+    # consecutive coordinate sets with identical bonds are set together
+    starts = []
+    rows = []
+    for cs_id, bonds in zip(cs_ids, bondsets):
+        if rows and np.array_equal(bonds, rows[-1]):
+            continue
+        starts.append(cs_id)
+        rows.append(bonds)
+    if not rows:
+        return
+    
+    mol_codes = np.zeros(max(mol_to_bo_map.keys()) + 1, dtype=np.int8)
+    for order, name in mol_to_bo_map.items():
+        mol_codes[order] = bond_order_code(name)
+    
+    n_atoms = struc.num_atoms
+    bonds = np.concatenate(rows)
+    row_index = np.repeat(np.arange(len(rows)), [len(row) for row in rows])
+    pair_keys = (
+        np.maximum(bonds[:, 0], bonds[:, 1]) * n_atoms +
+        np.minimum(bonds[:, 0], bonds[:, 1])
+    )
+    keys, cols = np.unique(pair_keys, return_inverse=True)
+    i, j = np.divmod(keys, n_atoms)
+    atoms = struc.atoms
+    timeline = bond_order_timeline(struc)
+    pair_ids = timeline.pair_ids(atoms.filter(i), atoms.filter(j))
+    
+    rows_per_block = max(1, max_codes // max(len(keys), 1))
+    stop = cs_ids[-1] + 1
+    for block_start in range(0, len(rows), rows_per_block):
+        block_stop = min(block_start + rows_per_block, len(rows))
+        in_block = (row_index >= block_start) & (row_index < block_stop)
+        codes = np.zeros((block_stop - block_start, len(keys)), dtype=np.int8)
+        codes[row_index[in_block] - block_start, cols[in_block]] = mol_codes[
+            bonds[in_block, 2]
+        ]
+        timeline.set_runs(
+            pair_ids,
+            starts[block_start:block_stop],
+            starts[block_stop] if block_stop < len(rows) else stop,
+            codes,
+        )
+
+
+def pending_bonds(structure, cs_id):
+    """
+    returns the (atom 1 index, atom 2 index, mol order) bonds of
+    a frame that has not been read from the SDF file yet, or
+    None if the frame has been read
+    bonds are sorted the same way as the pseudobond groups
+    """
+    pending = getattr(structure, "_ora_pending_frames", None)
+    if pending is None or cs_id not in pending.coords:
+        return None
+    bonds = _known_bonds(
+        pending.session,
+        pending.lazy_frames.frame(pending.coords[cs_id])[2],
+        pending._warned,
+    )
+    return _sort_bonds(bonds)
+
+
+def _sort_bonds(bonds):
+    """
+    sort (atom 1 index, atom 2 index, mol order) bonds the same
+    way as the pseudobond groups
+    """
+    group_rank = np.zeros(max(mol_to_bo_map.keys()) + 1, dtype=int)
+    group_rank[[8, 1, 4, 5, 2, 3]] = np.arange(6)
+    return bonds[np.argsort(group_rank[bonds[:, 2]], kind="stable")]
+
+
+def load_coordsets(structure, coordset_ids=None):
+    """
+    add frames from an SDF file that have not been read yet to the
+    structure's coordinate sets and bond order timeline
+    coordset_ids - coordinate sets to load; all are loaded if not given
+    this should be called before the coordinates or bond orders of
+    coordinate sets other than the active one are used
+    """
+    pending = getattr(structure, "_ora_pending_frames", None)
+    if pending is None:
+        return
+    if coordset_ids is None:
+        coordset_ids = list(pending.coords.keys())
+    for cs_id in coordset_ids:
+        if cs_id in pending.coords:
+            _, coords, bonds = pending.lazy_frames.frame(pending.coords.pop(cs_id))
+            if cs_id == structure.active_coordset_id:
+                structure.atoms.coords = coords
+            else:
+                structure.add_coordset(cs_id, coords)
+            _set_bond_orders(
+                structure,
+                [cs_id],
+                [_known_bonds(pending.session, bonds, pending._warned)],
+            )
+            for pair_id, code, start, stop in pending.edits:
+                if start <= cs_id < stop:
+                    bond_order_timeline(structure).set_runs(
+                        [pair_id], [cs_id], cs_id + 1, [[code]]
+                    )
+    
+    if not pending.coords:
+        pending.close()
+        del structure._ora_pending_frames
+
+
+def edit_bond_order(structure, atom1, atom2, name, start, stop):
+    """
+    set the bond order of atom1 and atom2 for coordinate sets start
+    up to (but not including) stop
+    name - one of bond_order_names or "broken"
+    frames that haven't been read from the SDF file yet keep this bond
+    order when they are read, so they don't need to be loaded first
+    """
+    timeline = bond_order_timeline(structure)
+    timeline.set_bond_order(atom1, atom2, name, start, stop)
+    pending = getattr(structure, "_ora_pending_frames", None)
+    if pending is not None:
+        pending.edits.append((
+            timeline.pair_ids([atom1], [atom2])[0], bond_order_code(name), start, stop,
+        ))
+
+
+def _pending_coordset_changed(trigger_name, data):
+    structure, changes = data
+    if getattr(structure, "_ora_pending_frames", None) is None:
+        return DEREGISTER
+    if "active_coordset changed" in changes.structure_reasons():
+        load_coordsets(structure, [structure.active_coordset_id])
+
+
+def _sdf_cache_dir():
+    from chimerax import app_dirs
+    return os.path.join(app_dirs.user_cache_dir, "ora_stuff", "sdf")
+
+
+def _sdf_cache_key(path, first, last, stride):
+    """
+    name of the cache entry for an SDF file
+    based on the path, size, modification time, record selection, and a hash
+    of a few blocks spread through the file
+    """
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((
+        SDF_CACHE_VERSION,
+        os.path.abspath(path),
+        stat.st_size,
+        stat.st_mtime_ns,
+        first,
+        last,
+        stride,
+    )).encode("utf-8"))
+    block_size = 1 << 20
+    with open(path, "rb") as f:
+        for i in range(0, 8):
+            f.seek(i * max(stat.st_size - block_size, 0) // 7)
+            digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def _read_sdf_cache(key):
+    """
+    returns elements, coordinates, and bonds for the cache entry
+    or None if there isn't one
+    coordinates are memory-mapped
+    """
+    entry = os.path.join(_sdf_cache_dir(), key)
+    try:
+        elements = np.load(os.path.join(entry, "elements.npy")).tolist()
+        coords = np.load(os.path.join(entry, "coords.npy"), mmap_mode="r")
+        bonds = np.load(os.path.join(entry, "bonds.npy")).astype(int)
+        n_bonds = np.load(os.path.join(entry, "n_bonds.npy"))
+        # the entry's modification time is used to evict the least recently
+        # used entries
+        os.utime(entry)
+    except (OSError, ValueError):
+        return None
+    return elements, coords, np.split(bonds, np.cumsum(n_bonds)[:-1])
+
+
+def _write_sdf_cache(session, key, elements, all_coordsets, all_bondsets):
+    """
+    add parsed SDF data to the cache, and remove the least recently used
+    entries if the cache is larger than SDF_CACHE_SIZE
+    """
+    bonds = np.concatenate(all_bondsets).astype(np.int32)
+    if all_coordsets.nbytes + bonds.nbytes > SDF_CACHE_SIZE:
+        return
+    cache_dir = _sdf_cache_dir()
+    tmp_entry = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_entry = tempfile.mkdtemp(dir=cache_dir, prefix=".tmp")
+        np.save(os.path.join(tmp_entry, "elements.npy"), np.array(elements))
+        np.save(os.path.join(tmp_entry, "coords.npy"), all_coordsets)
+        np.save(os.path.join(tmp_entry, "bonds.npy"), bonds.reshape(-1, 3))
+        np.save(
+            os.path.join(tmp_entry, "n_bonds.npy"),
+            np.array([len(b) for b in all_bondsets], dtype=np.int32),
+        )
+        os.replace(tmp_entry, os.path.join(cache_dir, key))
+        tmp_entry = None
+    except OSError as e:
+        session.logger.warning("could not cache SDF data: %s" % e)
+        return
+    finally:
+        if tmp_entry is not None:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+    
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.startswith(".tmp") or not entry.is_dir():
+            continue
+        size = sum(f.stat().st_size for f in os.scandir(entry.path))
+        entries.append((entry.stat().st_mtime, size, entry.path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= SDF_CACHE_SIZE:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_size -= size
+
+
+def open_sdf(
+    session,
+    stream,
+    filename,
+    first=1,
+    last=None,
+    stride=1,
+    lazy=False,
+    frameCache=64,
+    processes=1,
+    cache=True,
+    **kw
+):
+    """
+    open an SDF file
+    first - number of the first record to read (starting from 1)
+    last - number of the last record to read; default is the end of the file
+    stride - read every stride-th record after first
+    lazy - only index the records in the file, and read each frame the
+           first time it becomes the active coordinate set
+           frames that haven't been read are copies of the first frame,
+           this bundle's commands and saving a session read them first,
+           but other tools (e.g. measure or saving a PDB) see the copies
+    frameCache - number of decoded frames to keep when lazy is True
+    processes - number of processes to use to read the file
+                ignored if lazy is True
+    cache - load the parsed file from the cache if the file hasn't changed,
+            and add it to the cache otherwise
+            ignored if lazy is True
+    """
+    try:
+        frames = None
+        path = getattr(stream, "name", filename)
+        if isinstance(path, str) and _compression_module(path) is not None:
+            # read compressed files as a stream of decompressed text
+            stream.close()
+            stream = _open_text(path)
+            if lazy or processes > 1:
+                session.logger.warning(
+                    "lazy and processes are ignored for compressed files"
+                )
+                lazy = False
+                processes = 1
+
+        cache_key = None
+        if (
+            cache and
+            not lazy and
+            isinstance(path, str) and
+            os.path.isfile(path) and
+            os.path.getsize(path) >= SDF_CACHE_MIN_FILE_SIZE
+        ):
+            cache_key = _sdf_cache_key(path, first, last, stride)
+            cached = _read_sdf_cache(cache_key)
+        else:
+            cached = None
+
+        if lazy:
+            stream.close()
+            frames = _LazySDFFrames(
+                path,
+                cache_size=frameCache,
+                first=first,
+                last=last,
+                stride=stride,
+            )
+            if not len(frames):
+                raise RuntimeError("no V2000 or V3000 records found")
+            elements, first_coords, first_bonds = frames.frame(0)
+            all_coordsets = first_coords[np.newaxis]
+            all_bondsets = [first_bonds]
+        elif cached is not None:
+            elements, all_coordsets, all_bondsets = cached
+        elif processes > 1:
+            stream.close()
+            elements, all_coordsets, all_bondsets = _read_sdf_parallel(
+                path, processes, first=first, last=last, stride=stride,
+            )
+        else:
+            elements, all_coordsets, all_bondsets = _read_sdf(
+                stream, first=first, last=last, stride=stride,
+            )
 
         stream.close()
+        
+        if cache_key is not None and cached is None:
+            _write_sdf_cache(
+                session, cache_key, elements, all_coordsets, all_bondsets
+            )
 
         struc = AtomicStructure(session)
         struc.name = filename
@@ -128,40 +884,39 @@ def open_sdf(session, stream, filename, **kw):
             ele_counts[ele] += 1
             name = "%s%i" % (ele, ele_counts[ele])
             atom = struc.new_atom(name, ele)
-            atom.coord = np.array(all_coordsets[0][i])
+            atom.coord = all_coordsets[0][i]
             atom.serial_number = i + 1
             res.add_atom(atom)
         
-        struc.add_coordsets(np.array(all_coordsets), replace=True)
-        for cs_id, bondset in zip(struc.coordset_ids, all_bondsets):
-            for bond in bondset:
-                a1, a2, order = bond
-                try:
-                    pbg = struc.pseudobond_group(
-                        mol_to_bo_map[order],
-                        create_type=2
-                    )
-                    pbg.new_pseudobond(struc.atoms[a1], struc.atoms[a2], cs_id)
-                except KeyError:
-                    session.logger.warning("unknown bond order %i" % order)
-                    continue
-        
-        for bo_pbg, style in zip(
-            ["half", "single", "aromatic", "partial double", "double", "triple"],
-            [SetHalfBond, SetSingleBond, SetAromaticBond, SetPartialDoubleBond, SetDoubleBond, SetTripleBond]
-        ):
-            pbg = struc.pseudobond_group(
-                bo_pbg,
-                create_type=None,
-            )
-            if pbg is None:
-                continue
-            pbg.dashes = style.dashes
-            pbg.dashes += 2
-            pbg.dashes -= 2
-            pbg.color = style.color
-        
+        struc.add_coordsets(all_coordsets, replace=True)
         struc.active_coordset_id = struc.coordset_ids[0]
+        # bond orders are kept as runs of coordinate sets, and only the
+        # active coordinate set has pseudobonds
+        warned = set()
+        _set_bond_orders(
+            struc,
+            struc.coordset_ids,
+            [_known_bonds(session, bonds, warned) for bonds in all_bondsets],
+        )
+        if frames is not None:
+            # the other frames start as copies of the first frame
+            # and are filled in when they are visited
+            pending = _PendingFrames(session, struc, lazy_frames=frames)
+            pending._warned = warned
+            for ndx in range(1, len(frames)):
+                struc.add_coordset(ndx + 1, all_coordsets[0])
+                pending.coords[ndx + 1] = ndx
+            if pending.coords:
+                struc._ora_pending_frames = pending
+                pending.watch()
+                session.logger.info(
+                    "%i coordinate sets of %s are read from the file when they are "
+                    "shown, and they are copies of the first coordinate set until then" % (
+                        len(pending.coords), struc.name,
+                    )
+                )
+            else:
+                pending.close()
         
         return [struc], "opened file"
         
@@ -169,93 +924,375 @@ def open_sdf(session, stream, filename, **kw):
         stream.close()
         raise e
 
+def _frame_bonds(model, cs_id, atoms):
+    """
+    returns an n_bonds x 3 array of (atom 1 index, atom 2 index, mol bond order)
+    for the bond orders of a coordinate set
+    atoms - model.atoms
+    """
+    bonds = pending_bonds(model, cs_id)
+    if bonds is not None:
+        # this frame hasn't been read from the SDF file
+        return bonds
+    
+    timeline = bond_order_timeline(model)
+    codes = timeline.codes(cs_id)
+    bonded = np.flatnonzero(codes)
+    if not len(bonded):
+        return np.zeros((0, 3), dtype=int)
+    atoms1, atoms2 = timeline.pair_atoms()
+    code_to_mol = np.zeros(len(bond_order_code_names), dtype=int)
+    for order, name in mol_to_bo_map.items():
+        code_to_mol[bond_order_code(name)] = order
+    ndx1 = atoms.indices(atoms1[bonded])
+    ndx2 = atoms.indices(atoms2[bonded])
+    # pairs with deleted atoms aren't written
+    exists = (ndx1 >= 0) & (ndx2 >= 0)
+    return _sort_bonds(np.column_stack([
+        ndx1[exists],
+        ndx2[exists],
+        code_to_mol[codes[bonded[exists]]],
+    ]))
+
+
+def _sdf_atom_template(elements, style):
+    """
+    format string for the atom block of a record
+    only the coordinates need to be filled in
+    """
+    if style == "V3000":
+        return "".join(
+            "M  V30 %4i %2s %%10.6f %%10.6f %%10.6f 0\n" % (i + 1, ele)
+            for i, ele in enumerate(elements)
+        )
+    
+    if style == "V2000":
+        return "".join(
+            "%%10.4f%%10.4f%%10.4f %3s 0%3i  0  0  0  0  0  0  0  0\n" % (ele, 0)
+            for ele in elements
+        )
+    
+    raise NotImplementedError(style)
+
+
+def _sdf_record(name, style, atom_template, coords, bonds):
+    """
+    returns the text of one SDF record
+    atom_template - from _sdf_atom_template
+    coords - n_atoms x 3 array
+    bonds - n_bonds x 3 array of (atom 1 index, atom 2 index, mol bond order)
+    """
+    n_atoms = len(coords)
+    n_bonds = len(bonds)
+    out = [
+        "%s\n" % name,
+        "ORA stuff for ChimeraX\n",
+        "\n",
+    ]
+    if style == "V3000":
+        out.append("  0  0  0  0  0  0  0  0  0  0  0 V3000\n")
+        out.append("M  V30 BEGIN CTAB\n")
+        
+        out.append("M  V30 COUNTS %i %i 0 0 0\n" % (n_atoms, n_bonds))
+        out.append("M  V30 BEGIN ATOM\n")
+        out.append(atom_template % tuple(coords.ravel().tolist()))
+        out.append("M  V30 END ATOM\n")
+        out.append("M  V30 BEGIN BOND\n")
+        out.append(("M  V30 %3i %i %i %i\n" * n_bonds) % tuple(np.column_stack([
+            np.arange(1, n_bonds + 1),
+            bonds[:, 2],
+            bonds[:, 0] + 1,
+            bonds[:, 1] + 1,
+        ]).ravel().tolist()))
+        out.append("M  V30 END BOND\n")
+        out.append("M  V30 END CTAB\n")
+    
+    elif style == "V2000":
+        out.append("%3i%3i  0  0  0  0  0  0  0  0  0 V2000\n" % (n_atoms, n_bonds))
+        out.append(atom_template % tuple(coords.ravel().tolist()))
+        out.append(("%3i%3i%3i  0  0  0  0\n" * n_bonds) % tuple(np.column_stack([
+            bonds[:, 0] + 1,
+            bonds[:, 1] + 1,
+            bonds[:, 2],
+        ]).ravel().tolist()))
+    
+    else:
+        raise NotImplementedError(style)
+    
+    out.append("M END\n")
+    out.append("$$$$\n")
+    return "".join(out)
+
+
+def _sdf_records(name, style, atom_template, coords, bonds):
+    """
+    returns the text of the SDF records for each frame
+    this is run in worker processes when saving with more than one process
+    """
+    return "".join(
+        _sdf_record(name, style, atom_template, frame_coords, frame_bonds)
+        for frame_coords, frame_bonds in zip(coords, bonds)
+    )
+
+
 def save_sdf(
     session,
     path,
     model=None,
     style="V3000",
     coordsets=True,
+    compressionLevel=None,
+    processes=1,
 ):
+    """
+    save an SDF file
+    the file is compressed if path ends with .gz, .bz2, or .xz
+    compressionLevel - level passed to the compression module
+    processes - number of processes used to format the records
+    """
 
     if coordsets:
         write_coordsets = model.coordset_ids
     else:
         write_coordsets = [model.active_coordset_id]
+    load_coordsets(model, write_coordsets)
     
-    # write the mol3 file as we go through each set of coordinates
-    with open(path, "w") as f:
-        for cs_id in write_coordsets:
-            f.write("%s\n" % model.name)
-            f.write("ORA stuff for ChimeraX\n")
-            f.write("\n")
-
-            coords = model.coordset(cs_id).xyzs
-            # squared distance for each pair of atoms
-            
-            this_bonds = []
-            ndx = {a: i for i, a in enumerate(model.atoms)}
-            for pbg_name, order in zip(
-                ["half", "single", "aromatic", "partial double", "double", "triple"],
-                [0.5, 1.0, "ar", 1.5, 2.0, 3.0]
-            ):
-                pbg = model.pseudobond_group(
-                    pbg_name,
-                    create_type=None
-                )
-                if not pbg:
-                    continue
-                
-                for bond in pbg.get_pseudobonds(cs_id):
-                    this_bonds.append([ndx[bond.atoms[0]], ndx[bond.atoms[1]], order])
-
-            if style == "V3000":
-                f.write("  0  0  0  0  0  0  0  0  0  0  0 V3000\n")
-                f.write("M  V30 BEGIN CTAB\n")
-                
-                f.write("M  V30 COUNTS %i %i 0 0 0\n" % (model.num_atoms, len(this_bonds)))
-                f.write("M  V30 BEGIN ATOM\n")
-                for i, a in enumerate(model.atoms):
-                    f.write("M  V30 %4i %2s %10.6f %10.6f %10.6f 0\n" % (
-                        i + 1, a.element.name, *coords[i]
-                    ))
-                f.write("M  V30 END ATOM\n")
-                f.write("M  V30 BEGIN BOND\n")
-                for i, bond in enumerate(this_bonds):
-                    f.write("M  V30 %3i %i %i %i\n" % (
-                        i + 1,
-                        bo_to_mol_map[bond[2]],
-                        bond[0] + 1,
-                        bond[1] + 1
-                    ))
-                f.write("M  V30 END BOND\n")
-                f.write("M  V30 END CTAB\n")
-            
-            elif style == "V2000":
-                f.write("%3i%3i  0  0  0  0  0  0  0  0  0 V2000\n" % (model.num_atoms, len(this_bonds)))
-                for i, a in enumerate(model.atoms):
-                    f.write("%10.4f%10.4f%10.4f %3s 0%3i  0  0  0  0  0  0  0  0\n" % (
-                        *coords[i],
-                        a.element.name,
-                        0
-                    ))
-                for bond in this_bonds:
-                    f.write("%3i%3i%3i  0  0  0  0\n" % (
-                        bond[0] + 1,
-                        bond[1] + 1,
-                        bo_to_mol_map[bond[2]],
-                    ))
-                
-            else:
-                raise NotImplementedError(style)
-            
-            f.write("M END\n")
-            f.write("$$$$\n")
-
-def save_fbx(session, path, model=None, blenderPath=None, scriptOnly=False):
-    print(path, model, blenderPath, scriptOnly)
+    atoms = model.atoms
+    atom_template = _sdf_atom_template(atoms.elements.names, style)
+    
+    # write the mol3 file a chunk of coordinate sets at a time
+    # each chunk is a few MB of text
+    frames_per_chunk = max(1, SDF_WRITE_BUFFER_SIZE // max(len(atom_template), 1))
     
+    def chunk_args(start):
+        cs_ids = write_coordsets[start:start + frames_per_chunk]
+        return (
+            model.name,
+            style,
+            atom_template,
+            np.array([model.coordset(cs_id).xyzs for cs_id in cs_ids]),
+            [_frame_bonds(model, cs_id, atoms) for cs_id in cs_ids],
+        )
+    
+    chunk_starts = range(0, len(write_coordsets), frames_per_chunk)
+    with _open_text(path, "w", compression_level=compressionLevel) as f:
+        if processes > 1:
+            # chunks are formatted by the pool and written in order
+            # only a few chunks are in flight at once to limit memory use
+            with ProcessPoolExecutor(
+                max_workers=processes, mp_context=get_context("spawn")
+            ) as pool:
+                in_flight = deque()
+                for start in chunk_starts:
+                    if len(in_flight) >= 2 * processes:
+                        f.write(in_flight.popleft().result())
+                    in_flight.append(pool.submit(_sdf_records, *chunk_args(start)))
+                while in_flight:
+                    f.write(in_flight.popleft().result())
+        else:
+            for start in chunk_starts:
+                f.write(_sdf_records(*chunk_args(start)))
+
+def _fbx_cylinder_groups(model, coordset_ids):
+    """
+    returns groups of cylinders for the bonds and bond orders of model
+    each group has one color and is a tuple of
+    (name, color, cylinder names, atom indices 1, atom indices 2, radii, visible)
+    each pair of atoms gets a cylinder for every bond order it has in
+    any of the coordset_ids coordinate sets, and the cylinder is
+    only visible in the frames where the pair has that bond order
+    (visible is None for bonds)
+    """
+    groups = []
+    labels = atom_labels(model)
+    bonds = model.bonds
+    if len(bonds):
+        atoms1, atoms2 = bonds.atoms
+        ndx1 = model.atoms.indices(atoms1)
+        ndx2 = model.atoms.indices(atoms2)
+        radii = bonds.radii
+        # one group for each bond color
+        colors, color_ndx = np.unique(bonds.colors, axis=0, return_inverse=True)
+        color_ndx = color_ndx.ravel()
+        for i, color in enumerate(colors):
+            group = np.flatnonzero(color_ndx == i)
+            groups.append((
+                "bond_%i" % i,
+                color,
+                ["bond_%s_%s" % (labels[ndx1[j]], labels[ndx2[j]]) for j in group],
+                ndx1[group],
+                ndx2[group],
+                radii[group],
+                None,
+            ))
+
+    timeline = bond_order_timeline(model)
+    if not timeline.n_pairs:
+        return groups
+    atoms1, atoms2 = timeline.pair_atoms()
+    ndx1 = model.atoms.indices(atoms1)
+    ndx2 = model.atoms.indices(atoms2)
+    # pairs with deleted atoms aren't written
+    exists = (ndx1 >= 0) & (ndx2 >= 0)
+    codes = np.array([timeline.codes(cs_id) for cs_id in coordset_ids])
+    for name, style in bond_order_styles().items():
+        shown = codes == bond_order_code(name)
+        pairs = np.flatnonzero(shown.any(axis=0) & exists)
+        if not len(pairs):
+            continue
+        radius = FBX_BOND_ORDER_RADIUS
+        pbg = model.pseudobond_group(name, create_type=None)
+        if pbg is not None and pbg.num_pseudobonds:
+            radius = pbg.pseudobonds.radii.max()
+        groups.append((
+            name,
+            style.color,
+            ["%s_%s_%s" % (name, labels[ndx1[i]], labels[ndx2[i]]) for i in pairs],
+            ndx1[pairs],
+            ndx2[pairs],
+            np.full(len(pairs), radius),
+            shown[:, pairs],
+        ))
+    return groups
+
+
+def save_fbx(
+    session,
+    path,
+    model=None,
+    blenderPath=None,
+    scriptOnly=False,
+    coordsets=False,
+    frameRate=24.,
+    segments=None,
+    rings=None,
+    triangleBudget=None,
+    merge=False,
+    background=False,
+    batch=False,
+    callback=None,
+):
+    """
+    save an FBX file
+    if blenderPath and scriptOnly are not given, the file is written
+    without blender and includes bonds and bond orders
+    coordsets - animate the atoms and bond orders over all coordinate sets
+                (only without blender)
+    frameRate - frames per second of the animation
+    segments - number of segments around each sphere, cylinders get half as many
+    rings - number of rings of each sphere, default is half the segments
+    triangleBudget - about how many triangles the spheres and cylinders have
+                     when segments is not given, larger atoms and bonds get
+                     more segments
+    merge - combine the spheres and cylinders with the same material into
+            one mesh (only without blender and without coordsets)
+    background - run blender without waiting for it to finish
+                 blender jobs run one at a time
+    batch - with background, use the same blender process as other batch
+            exports that haven't started yet
+    callback - called with path and whether the FBX file was saved
+    """
     y_cor = 2.2
     
+    atoms = model.atoms
+    if triangleBudget is None:
+        triangleBudget = FBX_TRIANGLE_BUDGET
+    
+    # without blender, the FBX file is written directly
+    if not blenderPath and not scriptOnly:
+        if coordsets:
+            coordset_ids = model.coordset_ids
+        else:
+            coordset_ids = [model.active_coordset_id]
+        if merge and len(coordset_ids) > 1:
+            session.logger.warning("animated meshes cannot be merged")
+            merge = False
+        load_coordsets(model, coordset_ids)
+        # keys are single precision, so the coordinates are too
+        coords = np.empty((len(coordset_ids), model.num_atoms, 3), dtype=np.float32)
+        for frame_coords, cs_id in zip(coords, coordset_ids):
+            frame_coords[:] = model.coordset(cs_id).xyzs
+        
+        groups = _fbx_cylinder_groups(model, coordset_ids)
+        if segments is None:
+            per_radius = segments_per_radius(
+                atoms.display_radii,
+                np.concatenate([[]] + [group[5] for group in groups]),
+                triangleBudget,
+            )
+            atom_segments = sphere_segments(atoms.display_radii, per_radius)
+        else:
+            atom_segments = segments
+        atom_rings = rings
+        if atom_rings is None:
+            atom_rings = np.maximum(np.asarray(atom_segments) // 2, 2)
+        
+        scene = FBXScene(frame_rate=frameRate)
+        atom_spheres(
+            scene,
+            model,
+            coords,
+            segments=atom_segments,
+            rings=atom_rings,
+            y_cor=y_cor,
+            merge=merge,
+        )
+        for name, color, names, ndx1, ndx2, radii, visible in groups:
+            if segments is None:
+                bond_segments = cylinder_segments(radii, per_radius)
+            else:
+                bond_segments = max(segments // 2, 3)
+            add_cylinders(
+                scene,
+                names,
+                coords[:, ndx1],
+                coords[:, ndx2],
+                radii,
+                scene.add_material(name, linear_colors(color, y_cor)),
+                visible=visible,
+                segments=bond_segments,
+                merged_name=name if merge else None,
+            )
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        scene.write(path)
+        session.logger.info(
+            "saved FBX file to %s (%i triangles)" % (path, scene.n_triangles)
+        )
+        if segments is None and scene.n_triangles > triangleBudget:
+            session.logger.warning(
+                "the lowest resolution has more than %i triangles" % triangleBudget
+            )
+        if callback is not None:
+            callback(path, True)
+        return
+    
+    if coordsets:
+        session.logger.warning(
+            "coordinate sets are only animated when the FBX file is written without blender"
+        )
+    if merge:
+        session.logger.warning(
+            "meshes are only merged when the FBX file is written without blender"
+        )
+    
+    # blender only makes spheres
+    if segments is None:
+        per_radius = segments_per_radius(atoms.display_radii, [], triangleBudget)
+        atom_segments = sphere_segments(atoms.display_radii, per_radius)
+    else:
+        atom_segments = np.full(model.num_atoms, segments)
+    atom_rings = rings
+    if atom_rings is None:
+        atom_rings = np.maximum(atom_segments // 2, 2)
+    atom_rings = np.broadcast_to(atom_rings, model.num_atoms)
+    session.logger.info("%i triangles in the spheres" % np.sum(
+        sphere_triangles(atom_segments, atom_rings)
+    ))
+
+    elements = atoms.elements.names
+    colors = atoms.colors / 255.
+    colors[:, :3] **= y_cor
+    
     out = []
     out.append("import os")
     out.append("import bpy")
@@ -265,31 +1302,54 @@ def save_fbx(session, path, model=None, blenderPath=None, scriptOnly=False):
     # the spheres for the atoms get a unique label that is the
     # element + atom number (zero padded)
     label_format = "%%s%%0%ii" % pad
-    created_materials = []
-    for i, a in enumerate(model.atoms):
-        ele = a.element.name
-        atom_label = label_format % (ele, i + 1)
-        # create a sphere for this atom
-        out.append(
-            "bpy.ops.mesh.primitive_uv_sphere_add(radius=%f, location=(%f,%f,%f))" % (
-                a.display_radius, *a.coord
-            )
-        )
-        out.append("ob = bpy.data.objects[\"Sphere\"]")
-        out.append("ob.name = " + "\"%s\"" % atom_label)
-        if ele not in created_materials:
-            out.append("mat_%s = bpy.data.materials.new(name=\"%s\")" % (ele, ele))
-            out.append("mat_%s.use_nodes = False" % ele)
-            out.append("mat_%s.diffuse_color = (%f,%f,%f,%f)" % (
-                ele, (a.color[0] / 255.) ** y_cor, (a.color[1] / 255.) ** y_cor, (a.color[2] / 255.) ** y_cor, a.color[3] / 255.
-            ))
-            created_materials.append(ele)
-            # out.append("bpy.data.materials[\"%s\"].node_tree.nodes[\"Principled BSDF\"].inputs[0].default_value = (%f,%f,%f,%f)" % (
-            #     ele, a.color[0] / 255., a.color[1] / 255., a.color[2] / 255., a.color[3] / 255.
-            # ))
-        # set material and do smooth shading so it looks nice
-        out.append("ob.active_material = mat_%s" % ele)
-        out.append("bpy.ops.object.shade_smooth()")
+    
+    # atom data is written as a few lists instead of one line per atom
+    out.append("labels = %s" % repr([
+        label_format % (ele, i + 1) for i, ele in enumerate(elements)
+    ]))
+    out.append("elements = %s" % repr(elements.tolist()))
+    out.append("radii = [%s]" % ",".join("%f" % r for r in atoms.display_radii))
+    out.append("segments = [%s]" % ",".join("%i" % n for n in atom_segments))
+    out.append("rings = [%s]" % ",".join("%i" % n for n in atom_rings))
+    out.append("coords = [%s]" % ",".join(
+        "(%f,%f,%f)" % tuple(xyz) for xyz in atoms.coords
+    ))
+    # each element's material uses the color of the first atom of that element
+    _, first = np.unique(elements, return_index=True)
+    out.append("colors = {%s}" % ",".join(
+        "%s:(%f,%f,%f,%f)" % (repr(str(elements[i])), *colors[i]) for i in sorted(first)
+    ))
+    
+    # one sphere mesh is made for each element and radius, and each atom
+    # is an object linked to that mesh
+    # operators like primitive_uv_sphere_add update the scene every time
+    # they are used, so meshes are made with bmesh instead
+    out.append("materials = dict()")
+    out.append("for ele, color in colors.items():")
+    out.append("    materials[ele] = bpy.data.materials.new(name=ele)")
+    out.append("    materials[ele].use_nodes = False")
+    out.append("    materials[ele].diffuse_color = color")
+    out.append("meshes = dict()")
+    out.append("collection = bpy.context.scene.collection")
+    out.append("for label, ele, radius, n_segments, n_rings, coord in zip(labels, elements, radii, segments, rings, coords):")
+    out.append("    key = (ele, radius, n_segments, n_rings)")
+    out.append("    if key not in meshes:")
+    out.append("        bm = bmesh.new()")
+    out.append("        try:")
+    out.append("            bmesh.ops.create_uvsphere(bm, u_segments=n_segments, v_segments=n_rings, radius=radius)")
+    out.append("        except TypeError:")
+    # blender < 3.0 calls the radius diameter
+    out.append("            bmesh.ops.create_uvsphere(bm, u_segments=n_segments, v_segments=n_rings, diameter=radius)")
+    out.append("        mesh = bpy.data.meshes.new(\"%s_%f_%i_%i\" % key)")
+    out.append("        bm.to_mesh(mesh)")
+    out.append("        bm.free()")
+    # smooth shading so it looks nice
+    out.append("        mesh.polygons.foreach_set(\"use_smooth\", [True] * len(mesh.polygons))")
+    out.append("        mesh.materials.append(materials[ele])")
+    out.append("        meshes[key] = mesh")
+    out.append("    ob = bpy.data.objects.new(label, meshes[key])")
+    out.append("    ob.location = coord")
+    out.append("    collection.objects.link(ob)")
     
     # delete the standard cube, light, and camera
     out.append("objs = bpy.data.objects")
@@ -309,6 +1369,7 @@ def save_fbx(session, path, model=None, blenderPath=None, scriptOnly=False):
 
     out.append("bpy.ops.export_scene.fbx(filepath=export_path, check_existing=False)")
     # close blender when done
+    # scripts run by _BlenderJob keep going to the next script
     out.append("import sys; sys.exit(0)")
 
     # the corresponding python file with all the above code
@@ -324,14 +1385,210 @@ def save_fbx(session, path, model=None, blenderPath=None, scriptOnly=False):
         return
         
     # run blender on the .py file
-    proc = subprocess.Popen(
-        [blenderPath, "-P", script_name, "-b"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        encoding="utf8",
-    )
-    out, err = proc.communicate()
-    if out is not None:
-        session.logger.info("<pre>" + out + "</pre>", is_html=True)
-    if err is not None:
-        session.logger.warning("<pre>" + err + "</pre>", is_html=True)
\ No newline at end of file
+    if not background:
+        job = _BlenderJob(session, blenderPath)
+        job.add(script_name, path, callback)
+        job.run()
+        return
+    
+    # jobs start on the next frame, so batch exports from
+    # the same command line share a blender process
+    if batch and blender_jobs:
+        job = blender_jobs[-1]
+        if job.batch and job.proc is None and job.blender_path == blenderPath:
+            job.add(script_name, path, callback)
+            return
+    job = _BlenderJob(session, blenderPath, batch=batch)
+    job.add(script_name, path, callback)
+    blender_jobs.append(job)
+    session.triggers.add_handler("new frame", job.new_frame)
+    job.status()
+
+
+def _read_lines(stream, is_error, output):
+    """
+    put each line of stream on the output queue
+    """
+    for line in stream:
+        output.put((is_error, line))
+    stream.close()
+
+
+class _BlenderJob:
+    """
+    run blender on the python scripts written by save_fbx
+    all of the scripts are run by one blender process, and blender's
+    output is sent to the log as it arrives
+    """
+    def __init__(self, session, blender_path, batch=False):
+        self.session = session
+        self.blender_path = blender_path
+        self.batch = batch
+        # (script, FBX file, callback) for each export
+        self.exports = []
+        self.finished = set()
+        self.n_saved = 0
+        self.proc = None
+        self.batch_script = None
+        self.output = queue.Queue()
+        self.readers = []
+
+    def add(self, script_name, path, callback=None):
+        self.exports.append((script_name, path, callback))
+
+    def start(self):
+        # the factory settings are loaded before each script because
+        # the scripts delete the default cube, light, and camera
+        # scripts end with sys.exit, which is caught so the next one runs
+        fd, self.batch_script = tempfile.mkstemp(suffix=".py")
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join([
+                "import runpy",
+                "import sys",
+                "import traceback",
+                "import bpy",
+                "scripts = %s" % repr([script for script, _, _ in self.exports]),
+                "for i, script in enumerate(scripts):",
+                "    bpy.ops.wm.read_factory_settings()",
+                "    ok = True",
+                "    try:",
+                "        runpy.run_path(script, run_name=\"__main__\")",
+                "    except SystemExit as e:",
+                "        ok = not e.code",
+                "    except Exception:",
+                "        traceback.print_exc()",
+                "        ok = False",
+                "    print(%s, i, ok, flush=True)" % repr(_BLENDER_EXPORT_MARKER),
+            ]))
+        self.proc = subprocess.Popen(
+            [self.blender_path, "-b", "-P", self.batch_script],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf8",
+            errors="replace",
+        )
+        for stream, is_error in [(self.proc.stdout, False), (self.proc.stderr, True)]:
+            reader = threading.Thread(
+                target=_read_lines, args=(stream, is_error, self.output), daemon=True,
+            )
+            reader.start()
+            self.readers.append(reader)
+        self.status()
+
+    def step(self, block=True):
+        """
+        log blender's output and report finished exports
+        block - wait a little for blender to print something
+        returns False when blender is done
+        """
+        if self.proc is None:
+            self.start()
+        lines = []
+        try:
+            lines.append(self.output.get(block=block, timeout=0.1 if block else None))
+            while True:
+                lines.append(self.output.get_nowait())
+        except queue.Empty:
+            pass
+        self._log(lines)
+        if (
+            self.proc.poll() is None or
+            any(reader.is_alive() for reader in self.readers) or
+            not self.output.empty()
+        ):
+            return True
+        self.finish()
+        return False
+
+    def _log(self, lines):
+        out = []
+        err = []
+        for is_error, line in lines:
+            if is_error:
+                err.append(line)
+            elif line.startswith(_BLENDER_EXPORT_MARKER):
+                i, ok = line[len(_BLENDER_EXPORT_MARKER):].split()
+                self._export_finished(int(i), ok == "True")
+            else:
+                out.append(line)
+        if out:
+            self.session.logger.info(
+                "<pre>" + html.escape("".join(out)) + "</pre>", is_html=True
+            )
+        if err:
+            self.session.logger.warning(
+                "<pre>" + html.escape("".join(err)) + "</pre>", is_html=True
+            )
+
+    def _export_finished(self, i, ok):
+        self.finished.add(i)
+        _, path, callback = self.exports[i]
+        if ok:
+            self.n_saved += 1
+            self.session.logger.info("saved FBX file to %s" % path)
+        else:
+            self.session.logger.warning("blender did not save %s" % path)
+        if callback is not None:
+            callback(path, ok)
+        self.status()
+
+    def status(self):
+        if self.proc is None:
+            self.session.logger.status(
+                "waiting to run blender for %s" % ", ".join(path for _, path, _ in self.exports)
+            )
+            return
+        self.session.logger.status(
+            "running blender: %i/%i FBX files done" % (len(self.finished), len(self.exports))
+        )
+
+    def describe(self):
+        """
+        one line description of the job for the log
+        """
+        if self.proc is None:
+            state = "waiting"
+        else:
+            state = "running (%i/%i done)" % (len(self.finished), len(self.exports))
+        return "%s: %s" % (state, ", ".join(path for _, path, _ in self.exports))
+
+    def run(self):
+        while self.step():
+            pass
+
+    def new_frame(self, trigger_name, data):
+        if self not in blender_jobs:
+            return DEREGISTER
+        # jobs run one at a time
+        if blender_jobs[0] is not self:
+            return
+        if not self.step(block=False):
+            return DEREGISTER
+
+    def cancel(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+        self._shutdown()
+        self.session.logger.status("stopped blender after saving %i/%i FBX files" % (
+            self.n_saved, len(self.exports)
+        ))
+
+    def finish(self):
+        self._shutdown()
+        self.session.logger.status("blender saved %i/%i FBX files" % (
+            self.n_saved, len(self.exports)
+        ))
+
+    def _shutdown(self):
+        if self in blender_jobs:
+            blender_jobs.remove(self)
+        if self.batch_script is not None:
+            os.remove(self.batch_script)
+            self.batch_script = None
+        # exports that blender didn't get to
+        for i, (_, path, callback) in enumerate(self.exports):
+            if i not in self.finished:
+                self.finished.add(i)
+                self.session.logger.warning("blender did not save %s" % path)
+                if callback is not None:
+                    callback(path, False)
\ No newline at end of file
@@ -1,3 +1,5 @@
+from time import perf_counter
+
 from chimerax.mouse_modes import MouseMode
 from chimerax.atomic.structure import (
     PickedAtoms,
@@ -9,23 +11,16 @@ from chimerax.atomic.structure import (
 
 from SEQCROW.mouse_modes import DrawBondMouseMode
 
-# from cProfile import Profile
+from ora_stuff.bond_orders import bond_order_index
 
-bo_names = [
-    'broken',
-    'half',
-    'single',
-    'partial double',
-    'aromatic',
-    'double',
-    'triple',
-]
 
 class SetBondOrder(DrawBondMouseMode):
     name = None
     color = None
     dashes = 0
-    draw_new = True
+    # seconds a bond order edit should take
+    latency_budget = 0.05
+    last_latency = None
 
     def vr_press(self, event):
         self.mouse_up(event)
@@ -43,7 +38,13 @@ class SetBondOrder(DrawBondMouseMode):
             bond = pick.pbond
             if bond.group.name == self.name:
                 # run(self.session, "bond %s %s" % (bond.atoms[0].atomspec, bond.atoms[1].atomspec))
-                bond.delete()
+                structure = bond.atoms[0].structure
+                self.edit_bond_order(
+                    *bond.atoms,
+                    "broken",
+                    structure.active_coordset_id,
+                    structure.active_coordset_id + 1,
+                )
                 self.reset()
             else:
                 self.draw_new_pbond(*bond.atoms)
@@ -77,52 +78,43 @@ class SetBondOrder(DrawBondMouseMode):
             self.session.logger.status("drew new bond between %s and %s" % (
                 atom.atomspec, self._atom1.atomspec,
             ))
-            for bond in self._atom1.bonds:
-                if atom in bond.atoms:
-                    bond.delete()
-                    break
+            bond_order_index(atom.structure).delete_bond(self._atom1, atom)
             self.reset()
 
     def draw_new_pbond(self, atom1, atom2):
-        # profile = Profile()
-        # profile.enable()
+        # the bond order is changed for the rest of the trajectory
+        structure = atom1.structure
+        self.edit_bond_order(
+            atom1,
+            atom2,
+            self.name,
+            structure.active_coordset_id,
+            structure.coordset_ids[-1] + 1,
+        )
+
+    def edit_bond_order(self, atom1, atom2, name, start, stop):
+        """
+        set the bond order for a range of coordinate sets
+        the time this takes is kept in last_latency, and a message is
+        logged if it is more than latency_budget seconds
+        """
+        from ora_stuff.io import edit_bond_order
         
-        if self.draw_new:
-            pbg = atom1.structure.pseudobond_group(
-                self.name,
-                create_type=2
+        t0 = perf_counter()
+        edit_bond_order(atom1.structure, atom1, atom2, name, start, stop)
+        self.last_latency = perf_counter() - t0
+        if self.last_latency > self.latency_budget:
+            self.session.logger.info(
+                "setting %s bond took %.0f ms, more than the %.0f ms budget" % (
+                    name, 1000 * self.last_latency, 1000 * self.latency_budget,
+                )
             )
-            
-            for cs_id in range(atom1.structure.active_coordset_id, atom1.structure.coordset_ids[-1] + 1):
-                pbg.new_pseudobond(atom1, atom2, cs_id=cs_id)
-            # bug in older versions of ChimeraX where new pseudobonds aren't 
-            # displayed until something else changes
-            # change the number of dashes
-            pbg.dashes = self.dashes
-            pbg.dashes += 2
-            pbg.dashes -= 2
-            pbg.color = self.color
-        
-        for kind in bo_names:
-            if kind == self.name:
-                continue
-            other_pbg = atom1.structure.pseudobond_group(kind, create_type=None)
-            if not other_pbg:
-                continue
-            for cs_id in range(atom1.structure.active_coordset_id, atom1.structure.coordset_ids[-1] + 1):
-                pbs = other_pbg.get_pseudobonds(cs_id)
-                for pb in pbs:
-                    if atom1 in pb.atoms and atom2 in pb.atoms:
-                        other_pbg.delete_pseudobond(pb)
-        
-        # profile.disable()
-        # profile.print_stats()
+
 
 class SetBrokenBond(SetBondOrder):
     name = "broken"
     color = [0, 0, 0, 1]
     dashes = 0
-    draw_new = False
 
 
 class SetHalfBond(SetBondOrder):
@@ -0,0 +1,178 @@
+import importlib.util
+import struct
+import zlib
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+# fbx only needs numpy, so it is loaded without the rest of the
+# bundle (which needs ChimeraX)
+_spec = importlib.util.spec_from_file_location(
+    "ora_stuff_fbx", Path(__file__).parents[1] / "src" / "fbx.py"
+)
+fbx = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(fbx)
+
+_array_dtypes = {b"d": "<f8", b"f": "<f4", b"l": "<i8", b"i": "<i4", b"b": "?"}
+_scalar_formats = {b"C": "<?", b"Y": "<h", b"I": "<i", b"L": "<q", b"F": "<f", b"D": "<d"}
+
+
+def _read_property(data, offset):
+    prop_type = data[offset:offset + 1]
+    offset += 1
+    if prop_type in _scalar_formats:
+        fmt = _scalar_formats[prop_type]
+        return struct.unpack_from(fmt, data, offset)[0], offset + struct.calcsize(fmt)
+    if prop_type in (b"S", b"R"):
+        size, = struct.unpack_from("<I", data, offset)
+        value = data[offset + 4:offset + 4 + size]
+        if prop_type == b"S":
+            value = value.decode("utf-8")
+        return value, offset + 4 + size
+    size, encoding, length = struct.unpack_from("<III", data, offset)
+    raw = data[offset + 12:offset + 12 + length]
+    if encoding:
+        raw = zlib.decompress(raw)
+    array = np.frombuffer(raw, dtype=_array_dtypes[prop_type])
+    assert len(array) == size
+    return array, offset + 12 + length
+
+
+def _read_node(data, offset):
+    """
+    returns (name, properties, children) and the offset after the node
+    or None for a null record
+    """
+    end, n_properties, properties_length, name_length = struct.unpack_from("<IIIB", data, offset)
+    if end == 0:
+        return None, offset + 13
+    name = data[offset + 13:offset + 13 + name_length].decode("utf-8")
+    position = offset + 13 + name_length
+    properties = []
+    for _ in range(n_properties):
+        prop, position = _read_property(data, position)
+        properties.append(prop)
+    assert position == offset + 13 + name_length + properties_length
+    children = []
+    while position < end:
+        child, position = _read_node(data, position)
+        if child is None:
+            break
+        children.append(child)
+    # the end offset is where the next node starts
+    assert position == end, name
+    return (name, properties, children), end
+
+
+def _read_fbx(path):
+    """
+    returns the top level nodes of a binary FBX file by name
+    """
+    data = Path(path).read_bytes()
+    assert data.startswith(fbx._HEADER)
+    assert struct.unpack_from("<I", data, len(fbx._HEADER))[0] == fbx.FBX_VERSION
+    offset = len(fbx._HEADER) + 4
+    nodes = dict()
+    while True:
+        node, offset = _read_node(data, offset)
+        if node is None:
+            break
+        nodes[node[0]] = node
+    assert data[offset:offset + 16] == fbx._FOOT_ID
+    assert data.endswith(fbx._FOOT_MAGIC)
+    assert struct.unpack_from("<I", data, len(data) - 140)[0] == fbx.FBX_VERSION
+    # the footer is padded so the file length is 12 more than a multiple of 16
+    assert len(data) % 16 == 12
+    return nodes
+
+
+def _child(node, name):
+    return next(child for child in node[2] if child[0] == name)
+
+
+def _object_counts(nodes):
+    return Counter(child[0] for child in nodes["Objects"][2])
+
+
+def _connections(nodes):
+    """
+    (child, parent) of each object to object connection
+    """
+    return [
+        tuple(child[1][1:3]) for child in nodes["Connections"][2] if child[1][0] == "OO"
+    ]
+
+
+def test_scene_round_trip(tmp_path):
+    scene = fbx.FBXScene()
+    vertices, polygon_vertices, normals = fbx.uv_sphere(16, 8)
+    geometry_id = scene.add_mesh("sphere", vertices, polygon_vertices, normals)
+    material_id = scene.add_material("red", [1., 0., 0., 1.])
+    model_id = scene.add_model(
+        "ball", [1., 2., 3.], geometry_id=geometry_id, material_ids=[material_id]
+    )
+    scene.write(tmp_path / "scene.fbx")
+
+    nodes = _read_fbx(tmp_path / "scene.fbx")
+    assert _object_counts(nodes) == {"Geometry": 1, "Material": 1, "Model": 1}
+    assert sorted(_connections(nodes)) == sorted([
+        (model_id, 0), (geometry_id, model_id), (material_id, model_id),
+    ])
+    geometry = _child(nodes["Objects"], "Geometry")
+    # these arrays are long enough to be compressed
+    assert len(polygon_vertices) > fbx._COMPRESS_ARRAY_SIZE
+    np.testing.assert_array_equal(
+        _child(geometry, "Vertices")[1][0], scene.y_up(vertices).ravel()
+    )
+    np.testing.assert_array_equal(
+        _child(geometry, "PolygonVertexIndex")[1][0], polygon_vertices
+    )
+    assert scene.n_triangles == fbx.sphere_triangles(16, 8)
+
+
+def test_atom_spheres(tmp_path):
+    atoms = SimpleNamespace(
+        elements=SimpleNamespace(names=np.array(["C", "C", "O"])),
+        display_radii=np.array([0.5, 0.5, 0.4]),
+        colors=np.array([[144, 144, 144, 255]] * 2 + [[255, 0, 0, 255]], dtype=np.uint8),
+    )
+    model = SimpleNamespace(atoms=atoms, num_atoms=3)
+    coords = np.arange(18, dtype=float).reshape(2, 3, 3)
+    scene = fbx.FBXScene()
+    atom_ids = fbx.atom_spheres(scene, model, coords, segments=8, rings=4)
+    scene.write(tmp_path / "atoms.fbx")
+
+    nodes = _read_fbx(tmp_path / "atoms.fbx")
+    counts = _object_counts(nodes)
+    # both carbons share a mesh
+    assert counts["Geometry"] == 2
+    assert counts["Material"] == 2
+    assert counts["Model"] == 3
+    # each X, Y, Z channel of each atom is animated
+    assert counts["AnimationCurve"] == 9
+    assert counts["AnimationCurveNode"] == 3
+    parents = Counter(parent for child, parent in _connections(nodes))
+    # root, geometry, and material for each atom
+    assert all(parents[atom_id] == 2 for atom_id in atom_ids)
+    assert parents[0] == 3
+    assert scene.n_triangles == 3 * fbx.sphere_triangles(8, 4)
+
+
+def test_add_cylinders(tmp_path):
+    coords1 = np.array([[[0., 0., 0.], [1., 0., 0.]]])
+    coords2 = np.array([[[0., 0., 1.], [1., 2., 0.]]])
+    scene = fbx.FBXScene()
+    material_id = scene.add_material("grey", [.5, .5, .5, 1.])
+    cylinder_ids = fbx.add_cylinders(
+        scene, ["a", "b"], coords1, coords2, [0.1, 0.2], material_id, segments=8
+    )
+    scene.write(tmp_path / "cylinders.fbx")
+
+    nodes = _read_fbx(tmp_path / "cylinders.fbx")
+    assert _object_counts(nodes) == {"Geometry": 2, "Material": 1, "Model": 2}
+    connections = _connections(nodes)
+    assert len(connections) == 6
+    assert all((material_id, cylinder_id) in connections for cylinder_id in cylinder_ids)
+    assert scene.n_triangles == 2 * fbx.cylinder_triangles(8)
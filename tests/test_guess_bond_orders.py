@@ -0,0 +1,198 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("chimerax.atomic")
+pytest.importorskip("AaronTools")
+
+from AaronTools.atoms import BondOrder
+
+import ora_stuff.bond_orders as bond_orders
+import ora_stuff.commands.guess_bond_orders as guess_bond_orders
+
+
+class _Atom:
+    deleted = False
+
+    def __init__(self, name, number):
+        self.name = name
+        self.number = number
+
+
+class _Atoms(list):
+    """
+    enough of chimerax.atomic.Atoms for guessBondOrders
+    """
+    def __getitem__(self, ndx):
+        if isinstance(ndx, np.ndarray):
+            return _Atoms(list.__getitem__(self, i) for i in ndx)
+        return list.__getitem__(self, ndx)
+
+    def filter(self, ndx):
+        return self[np.asarray(ndx, dtype=int)]
+
+    def indices(self, atoms):
+        ndx = {atom: i for i, atom in enumerate(self)}
+        return np.array([ndx.get(atom, -1) for atom in atoms], dtype=int)
+
+    @property
+    def elements(self):
+        return SimpleNamespace(
+            names=np.array([atom.name for atom in self]),
+            numbers=np.array([atom.number for atom in self]),
+        )
+
+    @property
+    def intra_bonds(self):
+        return SimpleNamespace(atoms=(_Atoms(), _Atoms()))
+
+
+class _Triggers:
+    def add_handler(self, name, func):
+        return (name, func)
+
+    def remove_handler(self, handler):
+        pass
+
+
+class _Structure:
+    """
+    structure without covalent bonds and with one coordinate set per frame of coords
+    """
+    deleted = False
+    atomspec = "#1"
+
+    def __init__(self, atoms, coords):
+        self.atoms = atoms
+        self.coords = coords
+        self.coordset_ids = list(range(1, len(coords) + 1))
+        self.active_coordset_id = 1
+        self.bonds = []
+        self.triggers = _Triggers()
+        logger = SimpleNamespace(status=lambda *args, **kwargs: None, warning=print)
+        self.session = SimpleNamespace(triggers=_Triggers(), logger=logger)
+
+    def coordset(self, cs_id):
+        return SimpleNamespace(xyzs=self.coords[cs_id - 1])
+
+    def pseudobond_group(self, name, create_type=None):
+        return None
+
+
+@pytest.fixture(autouse=True)
+def _fake_atoms(monkeypatch):
+    monkeypatch.setattr(bond_orders, "Atoms", _Atoms)
+    # pseudobonds are only made for the active coordinate set, and
+    # these tests only check the timeline
+    monkeypatch.setattr(
+        bond_orders.BondOrderTimeline, "update_pseudobonds", lambda self, pair_ids=None: None
+    )
+
+
+def _stretched_ethane():
+    """
+    two carbons 1.54 A apart that are pulled to 10 A from frame 10 of 100,
+    with an oxygen that passes by the second carbon
+    the carbons have a single bond in every frame before bond orders are guessed
+    """
+    atoms = _Atoms([_Atom("C", 6), _Atom("C", 6), _Atom("O", 8)])
+    coords = np.zeros((100, 3, 3))
+    coords[:, 1, 0] = 1.54
+    coords[9:, 1, 0] = 10.
+    coords[:, 2] = [10., 8., 0.]
+    coords[40:60, 2, 1] = np.linspace(3., 0., 20) + 1.2
+    structure = _Structure(atoms, coords)
+    bond_orders.bond_order_timeline(structure).set_bond_order(
+        atoms[0], atoms[1], "single", 1, 101
+    )
+    return structure
+
+
+def _guessed_codes(structure, **kwargs):
+    atoms = structure.atoms
+    tables = guess_bond_orders._BondOrderTables(atoms, BondOrder(), 0.35, 0.6)
+    guess_bond_orders._GuessBondOrdersJob(
+        structure.session, structure, atoms, tables, structure.coordset_ids, **kwargs
+    ).run()
+    timeline = bond_orders.bond_order_timeline(structure)
+    # every pair of atoms, in the order (0, 1), (0, 2), ..., (1, 2), ...
+    ndx1, ndx2 = np.triu_indices(len(atoms), k=1)
+    pair_ids = timeline.pair_ids(atoms.filter(ndx1), atoms.filter(ndx2))
+    return np.array([timeline.codes(cs_id, pair_ids) for cs_id in structure.coordset_ids])
+
+
+def test_chunk_size_does_not_change_bond_orders(monkeypatch):
+    monkeypatch.setattr(guess_bond_orders, "GUESS_CHUNK_SIZE", 32)
+    codes = _guessed_codes(_stretched_ethane())
+    monkeypatch.setattr(guess_bond_orders, "GUESS_CHUNK_SIZE", 7)
+    np.testing.assert_array_equal(_guessed_codes(_stretched_ethane()), codes)
+    single = bond_orders.bond_order_code("single")
+    assert (codes[:9, 0] == single).all()
+    # the old single bond is removed in every chunk after the carbons are pulled apart
+    assert not codes[9:, 0].any()
+
+
+def _random_walk(seed):
+    """
+    carbons and oxygens moving around a small box, with random bond
+    orders for some pairs before bond orders are guessed
+    """
+    rng = np.random.default_rng(seed)
+    atoms = _Atoms(
+        _Atom("C", 6) if rng.random() < 0.7 else _Atom("O", 8) for _ in range(12)
+    )
+    coords = rng.uniform(0, 5, (1, len(atoms), 3)) + np.cumsum(
+        rng.normal(0, 0.08, (150, len(atoms), 3)), axis=0
+    )
+    structure = _Structure(atoms, coords)
+    timeline = bond_orders.bond_order_timeline(structure)
+    for _ in range(20):
+        i, j = rng.choice(len(atoms), 2, replace=False)
+        start = rng.integers(1, 150)
+        timeline.set_bond_order(
+            atoms[i],
+            atoms[j],
+            str(rng.choice(bond_orders.bond_order_names)),
+            start,
+            rng.integers(start + 1, 152),
+        )
+    return structure
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_incremental_matches_full(monkeypatch, seed):
+    monkeypatch.setattr(guess_bond_orders, "GUESS_CHUNK_SIZE", 32)
+    monkeypatch.setattr(guess_bond_orders, "INCREMENTAL_CHUNK_SIZE", 45)
+    codes = _guessed_codes(_random_walk(seed))
+    assert codes.any()
+    np.testing.assert_array_equal(
+        _guessed_codes(_random_walk(seed), incremental=True), codes
+    )
+
+
+def test_incremental_clears_stale_bond_orders(monkeypatch):
+    monkeypatch.setattr(guess_bond_orders, "GUESS_CHUNK_SIZE", 32)
+    monkeypatch.setattr(guess_bond_orders, "INCREMENTAL_CHUNK_SIZE", 45)
+    np.testing.assert_array_equal(
+        _guessed_codes(_stretched_ethane(), incremental=True),
+        _guessed_codes(_stretched_ethane()),
+    )
+
+
+def test_deleted_atoms_leave_the_timeline():
+    structure = _stretched_ethane()
+    codes = _guessed_codes(structure)
+    timeline = bond_orders.bond_order_timeline(structure)
+    carbon1, carbon2, oxygen = structure.atoms
+    carbon1.deleted = True
+    changes = SimpleNamespace(num_deleted_atoms=lambda: 1, structure_reasons=lambda: [])
+    timeline._structure_changed("changes", (structure, changes))
+    # the C-O pair is renumbered and keeps its bond orders
+    assert timeline.n_pairs == 1
+    pair_ids = timeline.pair_ids([carbon2], [oxygen])
+    assert timeline.n_pairs == 1
+    np.testing.assert_array_equal(
+        [timeline.codes(cs_id, pair_ids)[0] for cs_id in structure.coordset_ids],
+        codes[:, 2],
+    )
@@ -0,0 +1,50 @@
+from io import StringIO
+
+import numpy as np
+import pytest
+
+pytest.importorskip("chimerax.atomic")
+pytest.importorskip("AaronTools")
+
+from ora_stuff.io import _read_sdf
+
+
+def _v2000_record(coords, elements, bonds=()):
+    lines = ["test", "  ora_stuff", ""]
+    lines.append("%3i%3i  0  0  0  0  0  0  0  0999 V2000" % (len(coords), len(bonds)))
+    for (x, y, z), ele in zip(coords, elements):
+        lines.append("%10.4f%10.4f%10.4f %-3s 0  0  0  0  0  0  0  0  0  0  0  0" % (x, y, z, ele))
+    for a1, a2, order in bonds:
+        lines.append("%3i%3i%3i  0" % (a1, a2, order))
+    lines.extend(["M  END", "$$$$"])
+    return "\n".join(lines) + "\n"
+
+
+def test_read_records_without_bonds():
+    coords = [[0., 0., 0.], [1.25, -0.5, 2.]]
+    stream = StringIO(3 * _v2000_record(coords, ["C", "O"]))
+    elements, all_coordsets, all_bondsets = _read_sdf(stream)
+    assert elements == ["C", "O"]
+    assert all_coordsets.shape == (3, 2, 3)
+    np.testing.assert_array_equal(all_coordsets[1], coords)
+    assert [bonds.shape for bonds in all_bondsets] == [(0, 3)] * 3
+
+
+def test_read_single_atom_records():
+    stream = StringIO(2 * _v2000_record([[1., 2., 3.]], ["C"]))
+    elements, all_coordsets, all_bondsets = _read_sdf(stream)
+    assert elements == ["C"]
+    np.testing.assert_array_equal(all_coordsets, [[[1., 2., 3.]]] * 2)
+    assert [bonds.shape for bonds in all_bondsets] == [(0, 3)] * 2
+
+
+def test_read_records_with_and_without_bonds():
+    coords = [[0., 0., 0.], [1., 0., 0.]]
+    stream = StringIO(
+        _v2000_record(coords, ["C", "O"]) +
+        _v2000_record(coords, ["C", "O"], bonds=[(1, 2, 2)]) +
+        _v2000_record(coords, ["C", "O"])
+    )
+    # small batches so each batch has a different mix of records
+    elements, all_coordsets, all_bondsets = _read_sdf(stream, batch_size=2)
+    assert [bonds.tolist() for bonds in all_bondsets] == [[], [[0, 1, 2]], []]